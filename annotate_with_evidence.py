@@ -30,18 +30,53 @@ import re
 import time
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is optional, but parses API responses faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL = "https://mastermind.genomenon.com/api/v2/"
 # Find your API token by logging in, visiting https://mastermind.genomenon.com/api, and clicking the link that says "Click here to fetch your API token".
 API_TOKEN = "INSERT API TOKEN HERE"
 ASSEMBLY = "grch37"
 
-def api_request(endpoint, options, request_type="GET", json_request=True):
-    params = options.copy()
-    params.update({'api_token': API_TOKEN})
+# While waiting for the annotation job, check its status after POLL_INITIAL
+# seconds, then wait POLL_FACTOR times longer before each later check, up to
+# POLL_MAX seconds between checks:
+POLL_INITIAL = 1.0
+POLL_FACTOR = 1.5
+POLL_MAX = 30.0
+
+# Stop waiting after this many seconds. The job keeps running, and can be
+# picked up later by passing its Job ID (set to None to wait indefinitely):
+MAX_WAIT = 6*60*60
+
+# Number of seconds to wait for the API to respond before retrying a request:
+TIMEOUT = 30
+
+# Retry requests that fail with a temporary server error, rate limit, time out
+# or dropped connection, waiting a little longer before each attempt. Once out
+# of retries, the last error is printed as usual.
+RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[408, 429, 500, 502, 503, 504], raise_on_status=False)
 
+# Share one connection across all API requests, so that polling the job status
+# doesn't open a new connection every time.
+SESSION = requests.Session()
+SESSION.params = {'api_token': API_TOKEN}
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRIES))
+
+def api_request(endpoint, options, request_type="GET", json_request=True, stream=False):
     # print("Querying API: ", endpoint, options)
-    response = requests.request(request_type, url=URL+endpoint, params=params)
+    try:
+        response = SESSION.request(request_type, url=URL+endpoint, params=options, stream=stream, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        # Raised once retries run out without any response to print
+        print(e)
+        sys.exit(0)
 
     if json_request:
         return json_or_print_error(response)
@@ -50,6 +85,8 @@ def api_request(endpoint, options, request_type="GET", json_request=True):
 
 def json_or_print_error(response):
     if response.status_code == requests.codes.ok:
+        if orjson:
+            return orjson.loads(response.content)
         return response.json()
     else:
         print(response.status_code)
@@ -63,14 +100,27 @@ def wait_for_success(job_url):
     state = response['state']
 
     i = 3
+    # Check back quickly at first, so short jobs are picked up soon after they
+    # finish, then back off so long jobs aren't polled needlessly often
+    delay = POLL_INITIAL
+    started = time.time()
     sys.stdout.write('\r' + message)
     sys.stdout.flush()
     while state == "created" or state == "started":
+        if MAX_WAIT is not None and time.time() - started > MAX_WAIT:
+            sys.stdout.write("\n")
+            return response, state
+
         sys.stdout.write('\r' + message + i*'.')
         sys.stdout.flush()
-        time.sleep(5)
+        time.sleep(delay)
+        delay = min(delay * POLL_FACTOR, POLL_MAX)
         i += 1
         response = api_request(job_url, {})
+        # Once the job starts processing, check back quickly again in case
+        # it's a short one
+        if response['state'] != state:
+            delay = POLL_INITIAL
         state = response['state']
 
     sys.stdout.write("\n")
@@ -102,14 +152,28 @@ def main(args):
         # 2. Upload VCF or annotated VCF file for annotation
         print("Uploading file...")
         with open(input_vcf_path, 'rb') as f:
-            requests.put(upload_url, data=f, headers={'Content-Type': 'application/octet-stream'})
+            try:
+                requests.put(upload_url, data=f, headers={'Content-Type': 'application/octet-stream'}, timeout=TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                print(e)
+                print("Upload failed for Job ID " + job_id + ". Run again with the Job ID to retry the upload.")
+                sys.exit(1)
 
     if state == "created" or state == "started":
-        # 3. Periodically check status until job is finished
-        response, state = wait_for_success("file_annotations/counts/" + job_id)
+        # 3. Periodically check status until job is finished. The job keeps
+        # running on the server if waiting is interrupted, so say how to
+        # pick it back up.
+        try:
+            response, state = wait_for_success("file_annotations/counts/" + job_id)
+        except KeyboardInterrupt:
+            print("\nStopped waiting for Job ID " + job_id + ". Run again with the Job ID to continue waiting.")
+            sys.exit(1)
 
     if state == "succeeded":
         print("Successfully annotated. " + str(response['annotated']) + " out of " + str(response['records']) + " have annotations.")
+    elif state == "created" or state == "started":
+        print("Gave up waiting for Job ID " + job_id + ". Run again with the Job ID to continue waiting.")
+        sys.exit(1)
     else:
         print("There was an error processing the file for Job ID " + job_id)
         sys.exit(1)
@@ -119,9 +183,11 @@ def main(args):
     # 4. Download annotated file
     output_file_path = re.sub(r"\.vcf(\.gz)?$", ".annotated-" + job_id + ".vcf.gz", input_vcf_path)
     print("Downloading annotated file to " + output_file_path)
-    downloaded_file = api_request("file_annotations/counts/" + job_id + "/download", {}, json_request=False)
+    # Stream the file to disk in chunks rather than holding it all in memory
+    downloaded_file = api_request("file_annotations/counts/" + job_id + "/download", {}, json_request=False, stream=True)
     with open(output_file_path, 'wb') as output_file:
-        output_file.write(downloaded_file.content)
+        for chunk in downloaded_file.iter_content(chunk_size=64*1024):
+            output_file.write(chunk)
 
 if __name__ == "__main__":
     main(sys.argv)
@@ -15,110 +15,123 @@ This will produce several separate gzip-compressed VCF output files.
 
 import sys
 import re
+import io
 import gzip
 import fnmatch
 
+# gzip compression level for the output files, from 1 (fastest) to 9
+# (smallest). Level 6 is what the gzip command uses by default, and is several
+# times faster than level 9 for only slightly larger files:
+COMPRESS_LEVEL = 6
+
+# Size in bytes of the buffers for reading gzip-compressed input and writing
+# each output file:
+BUFFER_SIZE = 1024*1024
+
+# Variants are sorted into categories by the type of change in their lowercased
+# MMID3 identifiers, checked in this order. Substitutions are split up further
+# by whether they're SNVs or MNVs, and cited at the cDNA or only protein level.
+CODING_RE = re.compile(rb":.*(fs|dup|del|ins|inv|ext)(,|$)")
+SUBSTITUTION_RE = re.compile(rb":[arndcqeghilkmfpstwyvxmu]\d+[arndcqeghilkmfpstwyvxmu](,|$)")
+NON_CODING_RE = re.compile(rb":.*(sa|sd|3utr|5utr|int|ugv)(,|$)|:.*multi-intron")
+
 def open_file(filename):
     if fnmatch.fnmatch(filename, '*.gz'):
-        with gzip.open(filename, "r") as lines:
-            parse(lines, filename)
+        # GzipFile reads lines slowly on its own, so read it through a buffer
+        with gzip.open(filename, "rb") as compressed:
+            parse(io.BufferedReader(compressed, BUFFER_SIZE), filename)
     else:
-        with open(filename, "r") as lines:
+        with open(filename, "rb") as lines:
             parse(lines, filename)
 
+def output_path(filename, cat):
+    path, replaced = re.subn(r"\.vcf(\.gz)?$", "." + cat + ".vcf.gz", filename)
+    # Keep the whole name of inputs that don't end in .vcf or .vcf.gz, so that
+    # the output never overwrites the input while it's still being read
+    if not replaced:
+        path = filename + "." + cat + ".vcf.gz"
+    return path
+
 def parse(lines, filename):
     readlines = False
-    split = {'non-coding': [], 'coding': [], 'substitution-snvs-cdna': [], 'substitution-snvs-protein': [], 'substitution-mnvs-cdna': [], 'substitution-mnvs-protein': [], 'other': []}
+    counts = {'non-coding': 0, 'coding': 0, 'substitution-snvs-cdna': 0, 'substitution-snvs-protein': 0, 'substitution-mnvs-cdna': 0, 'substitution-mnvs-protein': 0, 'other': 0}
+    output_files = {}
     split_substitution_mnv_possibilities = {}
     header_lines = []
 
-    i = 0
-    for line in lines:
-        if readlines:
-            i+=1
-            # Only process first 1000 lines of VCF file for faster debugging
-            # if i > 10000:
-                # break
-            out = re.split(r'\t', line)
-            chrom, pos, ref, alt, data = out[0], out[1], out[3], out[4], out[7]
-            if ref == '.':
-                ref = ''
-            if alt == '.':
-                alt = ''
-            data = re.split(';', data)
-            mmcnt1 = int(re.split('=', data[2])[1])
-            mmcnt2 = int(re.split('=', data[3])[1])
-            mmcnt3 = int(re.split('=', data[4])[1])
-            mmid3 = re.split('=', data[-2])[1].rstrip()
-            mmid3_list = re.split(',', mmid3)
-            hgvs = re.split('=', data[0])[1].rstrip()
-            gene = mmid3.split(':', 1)[0]
-
-            if re.search(r":.*fs(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":.*dup(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":.*delins(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":.*del(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":.*ins(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":.*inv(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":.*ext(,|$)", mmid3, flags=re.IGNORECASE):
-                split['coding'].append(line)
-            elif re.search(r":[ARNDCQEGHILKMFPSTWYVXMU]\d+[ARNDCQEGHILKMFPSTWYVXMU](,|$)", mmid3, flags=re.IGNORECASE):
-                if len(ref) == 1:
-                    if mmcnt1 > 0:
-                        split['substitution-snvs-cdna'].append(line)
+    # Write each line straight to its category's file rather than holding the
+    # whole CVR in memory. Files are only created once they have a line to
+    # write, after the header has been read.
+    def write(cat, line):
+        output_file = output_files.get(cat)
+        if output_file is None:
+            # Compressing many small writes is slow, so buffer them as well
+            output_file = output_files[cat] = io.BufferedWriter(gzip.open(output_path(filename, cat), 'wb', COMPRESS_LEVEL), BUFFER_SIZE)
+            output_file.write(b''.join(header_lines))
+        output_file.write(line)
+        counts[cat] += 1
+
+    try:
+        i = 0
+        for line in lines:
+            if readlines:
+                i+=1
+                # Only process first 1000 lines of VCF file for faster debugging
+                # if i > 10000:
+                    # break
+                # Only REF and INFO are needed to categorize the line, and of the
+                # INFO fields only MMCNT1 and MMID3, so skip parsing the rest
+                out = line.split(b'\t', 8)
+                ref, data = out[3], out[7]
+                if ref == b'.':
+                    ref = b''
+                data = data.split(b';')
+                mmcnt1 = int(data[2].partition(b'=')[2])
+                mmid3 = data[-2].partition(b'=')[2].rstrip()
+                # Lowercase once so the patterns don't need to ignore case
+                mmid3_lower = mmid3.lower()
+
+                if CODING_RE.search(mmid3_lower):
+                    write('coding', line)
+                elif SUBSTITUTION_RE.search(mmid3_lower):
+                    if len(ref) == 1:
+                        if mmcnt1 > 0:
+                            write('substitution-snvs-cdna', line)
+                        else:
+                            write('substitution-snvs-protein', line)
                     else:
-                        split['substitution-snvs-protein'].append(line)
+                        # MNVs can only be split once all the lines for the
+                        # same variant have been seen, so hold on to these
+                        if mmid3 in split_substitution_mnv_possibilities:
+                            split_substitution_mnv_possibilities[mmid3].append([ref, mmcnt1, line])
+                        else:
+                            split_substitution_mnv_possibilities[mmid3] = [[ref, mmcnt1, line]]
+                elif NON_CODING_RE.search(mmid3_lower):
+                    write('non-coding', line)
                 else:
-                    if mmid3 in split_substitution_mnv_possibilities:
-                        split_substitution_mnv_possibilities[mmid3].append([ref, mmcnt1, line])
-                    else:
-                        split_substitution_mnv_possibilities[mmid3] = [[ref, mmcnt1, line]]
-            elif re.search(r":.*sa(,|$)", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
-            elif re.search(r":.*sd(,|$)", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
-            elif re.search(r":.*3utr(,|$)", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
-            elif re.search(r":.*5utr(,|$)", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
-            elif re.search(r":.*int(,|$)", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
-            elif re.search(r":.*ugv(,|$)", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
-            elif re.search(r":.*multi-intron", mmid3, flags=re.IGNORECASE):
-                split['non-coding'].append(line)
+                    write('other', line)
+
             else:
-                split['other'].append(line)
-
-        else:
-            header_lines.append(line)
-
-            if line.find("#CHROM") == 0:
-                readlines = True
-
-    for mmid3, values in split_substitution_mnv_possibilities.iteritems():
-        min_ref = min(map(lambda x: len(x[0]), values))
-        for ref, mmcnt1, line in values:
-            if mmcnt1 > 0:
-                split['substitution-mnvs-cdna'].append(line)
-            elif len(ref) == min_ref:
-                split['substitution-mnvs-protein'].append(line)
-
-    for cat, lines in split.iteritems():
-        if len(lines) > 0:
-            print cat + ': ' + str(len(lines))
-            output_file_path = re.sub(r"\.vcf(\.gz)?$", "." + cat + ".vcf.gz", filename)
-
-            print("\tSaving annotations to " + output_file_path)
-            with gzip.open(output_file_path, 'wb') as output_file:
-                output_file.write(''.join(header_lines))
-                output_file.write(''.join(lines))
+                header_lines.append(line)
+
+                if line.startswith(b"#CHROM"):
+                    readlines = True
+
+        for mmid3, values in split_substitution_mnv_possibilities.items():
+            min_ref = min(map(lambda x: len(x[0]), values))
+            for ref, mmcnt1, line in values:
+                if mmcnt1 > 0:
+                    write('substitution-mnvs-cdna', line)
+                elif len(ref) == min_ref:
+                    write('substitution-mnvs-protein', line)
+    finally:
+        for output_file in output_files.values():
+            output_file.close()
+
+    for cat, count in counts.items():
+        if count > 0:
+            print(cat + ': ' + str(count))
+            print("\tSaved annotations to " + output_path(filename, cat))
 
 def main(args):
     open_file(args[-1])
@@ -14,6 +14,10 @@ candidate will increase the sensitivity of the found associations, but will
 also increase the number of API calls used and also the amount of time it takes
 to run. The maximum value is 5000.
 
+If you expect to run this several times over overlapping genes or diseases,
+you may also set CACHE_FILE below, so that API responses are saved to disk and
+reused on later runs instead of being fetched again.
+
 Then run the file directly from the command line:
     ./gene_fusion_evidence.py
 
@@ -31,10 +35,22 @@ candidate(s).
 import sys
 import re
 import json
+import time
+import shelve
+import atexit
+import threading
 import requests
-import urllib
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import urllib.parse
 from collections import defaultdict
-import codecs
+from multiprocessing.pool import ThreadPool
+
+# orjson is optional, but parses API responses faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL = "https://mastermind.genomenon.com/api/v2/"
 # Find your API token by logging in, visiting https://mastermind.genomenon.com/api, and clicking the link that says "Click here to fetch your API token".
@@ -43,17 +59,76 @@ API_TOKEN = "INSERT API TOKEN HERE"
 DEFAULT_MAX_ARTICLES = 1000
 _sensitivity = DEFAULT_MAX_ARTICLES
 
+# To reuse API responses across runs, set this to the path of a file to cache
+# them in, e.g. "mastermind_cache". Delete the file to clear the cache:
+CACHE_FILE = False #"mastermind_cache"
+
+# Number of seconds after which a cached API response is fetched again:
+CACHE_EXPIRATION = 24*60*60
+
+# Maximum number of API requests to have in flight at once when fetching pages
+# of results.
+MAX_WORKERS = 16
+
+# Number of seconds to wait for the API to respond before retrying a request:
+TIMEOUT = 30
+
+# Retry requests that fail with a temporary server error, rate limit, time out
+# or dropped connection, waiting a little longer before each attempt. Once out
+# of retries, the last error is printed as usual.
+RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[408, 429, 500, 502, 503, 504], raise_on_status=False)
+
+# Share one connection pool across all API requests, so that requests reuse
+# open connections instead of making a new one for every call.
+SESSION = requests.Session()
+SESSION.params = {'api_token': API_TOKEN}
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRIES, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+_cache = None
+_cache_lock = threading.Lock()
+_last_progress = 0
+
 def api_get(endpoint, options):
-    params = options.copy()
-    params.update({'api_token': API_TOKEN})
+    if CACHE_FILE:
+        cache_key = json.dumps([endpoint, sorted(options.items())])
+        data = cache_read(cache_key)
+        if data is not None:
+            return data
 
     # print("Querying API: ", endpoint, options)
-    response = requests.get(url=URL+endpoint, params=params)
+    try:
+        response = SESSION.get(url=URL+endpoint, params=options, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        # Raised once retries run out without any response to print
+        print(e)
+        sys.exit(0)
+
+    data = json_or_print_error(response)
+    if CACHE_FILE:
+        cache_write(cache_key, data)
+    return data
+
+def open_cache():
+    global _cache
+    if _cache is None:
+        _cache = shelve.open(CACHE_FILE)
+        atexit.register(_cache.close)
+    return _cache
 
-    return json_or_print_error(response)
+def cache_read(key):
+    with _cache_lock:
+        entry = open_cache().get(key)
+    if entry is not None and time.time() - entry[0] < CACHE_EXPIRATION:
+        return entry[1]
+
+def cache_write(key, data):
+    with _cache_lock:
+        open_cache()[key] = (time.time(), data)
 
 def json_or_print_error(response):
     if response.status_code == requests.codes.ok:
+        if orjson:
+            return orjson.loads(response.content)
         return response.json()
     else:
         print(response.status_code)
@@ -61,18 +136,46 @@ def json_or_print_error(response):
         sys.exit(0)
 
 def encode(str):
-    if sys.version_info[0] < 3:
-        return urllib.quote_plus(str)
-    else:
-        return urllib.parse.quote_plus(str)
+    return urllib.parse.quote_plus(str)
+
+def pool_map(func, items):
+    # Calls func for each item using a pool of threads, yielding results in
+    # the same order as items. API errors call sys.exit(), which would only
+    # end the worker thread, so hand those back to exit from the main thread.
+    def call(item):
+        try:
+            return False, func(item)
+        except SystemExit as e:
+            return True, e
+
+    pool = ThreadPool(MAX_WORKERS)
+    try:
+        for exited, result in pool.imap(call, items):
+            if exited:
+                raise result
+            yield result
+    finally:
+        pool.terminate()
 
 def print_progress(iteration, total, prefix='', suffix='', decimals=1, bar_length=100):
+    global _last_progress
+    # A progress bar is only useful on a terminal, not when output is
+    # redirected to a file
+    if not sys.stdout.isatty():
+        return
+
+    # Redraw at most 20 times a second, but always draw the finished bar
+    now = time.time()
+    if iteration != total and now - _last_progress < 0.05:
+        return
+    _last_progress = now
+
     str_format = "{0:." + str(decimals) + "f}"
     percents = str_format.format(100 * (iteration / float(total)))
     filled_length = int(round(bar_length * iteration / float(total)))
     bar = 'M' * filled_length + '-' * (bar_length - filled_length)
 
-    sys.stdout.write('\r%s |%s| %s%s %s' % (prefix, bar, percents, '%', suffix)),
+    sys.stdout.write('\r%s |%s| %s%s %s' % (prefix, bar, percents, '%', suffix))
 
     if iteration == total:
         sys.stdout.write('\n')
@@ -84,7 +187,7 @@ def get_mode(options):
     # Turn number of options into text, e.g.: "1, 2 or 3"
     valid = ' or '.join( ', '.join([str(i) for i in range(1, len(options)+1)]).rsplit(', ', 1))
     while mode is None:
-        entered = raw_input("\t" + '\n\t'.join(options) + "\n(Type " + valid + " and hit Enter): ")
+        entered = input("\t" + '\n\t'.join(options) + "\n(Type " + valid + " and hit Enter): ")
         try:
             mode = int(entered)
             if mode > len(options):
@@ -107,7 +210,7 @@ def choose_sensitivity():
     print("Choose maximum number of articles to fetch for each gene. The more articles, the more complete the results, but the longer the program will take to run.")
     sensitivity_entered = None
     while sensitivity_entered is None:
-        sensitivity_entered = re.sub('[,\.]', '', raw_input("Enter sensitivity (between 1 and 10,000), or leave blank for default [" + str(DEFAULT_MAX_ARTICLES) + "], and press Enter: "))
+        sensitivity_entered = re.sub(r'[,\.]', '', input("Enter sensitivity (between 1 and 10,000), or leave blank for default [" + str(DEFAULT_MAX_ARTICLES) + "], and press Enter: "))
         if sensitivity_entered:
             try:
                 _sensitivity = int(sensitivity_entered)
@@ -122,7 +225,7 @@ def choose_suggestion(suggestion_type, prompt):
     value = None
     while value is None:
         options = {}
-        suggestion_input = raw_input(prompt)
+        suggestion_input = input(prompt)
         options[suggestion_type] = suggestion_input
         suggestions = api_get("suggestions", options)
         if len(suggestions) == 0:
@@ -138,21 +241,24 @@ def fusion_pmids(options):
     params.update({'categories[]': ['fusion', 'breakpoint']})
 
     data = api_get("articles", params)
-    pmids = [article['pmid'] for article in data['articles']]
+    pmids = set(article['pmid'] for article in data['articles'])
 
     articles = min(int(data['article_count']), _sensitivity)
-    pages = min(int(data['pages']), _sensitivity/5)
+    pages = min(int(data['pages']), _sensitivity//5)
+    # Nothing more to fetch or show progress for when the gene has no articles
+    if pages < 1:
+        return pmids
 
-    print_progress(1, pages, prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['gene']).upper() + ':', suffix = 'Complete', bar_length = 50)
+    progress_prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['gene']).upper() + ':'
+    print_progress(1, pages, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
     if pages > 1:
-        for page in range(2, pages+1):
-        # for page in range(2, 3):
-            print_progress(page, pages, prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['gene']).upper() + ':', suffix = 'Complete', bar_length = 50)
+        # Page count is known after the first page, so fetch the rest concurrently
+        page_params = [dict(params, page=page) for page in range(2, pages+1)]
+        for page, data in enumerate(pool_map(lambda page_options: api_get("articles", page_options), page_params), 2):
+            print_progress(page, pages, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
-            params.update({'page': page})
-            data = api_get("articles", params)
-            pmids = pmids + [article['pmid'] for article in data['articles']]
+            pmids.update(article['pmid'] for article in data['articles'])
 
     return pmids
 
@@ -168,7 +274,7 @@ def gene_pair_search(gene_a=None, gene_b=None, gene_a_pmids=None, gene_b_pmids=N
     if gene_b_pmids is None:
         gene_b_pmids = fusion_pmids({'gene': gene_b})
 
-    intersection = list(set(gene_a_pmids)&set(gene_b_pmids))
+    intersection = sorted(gene_a_pmids & gene_b_pmids)
 
     pmids_by_gene_pair = {}
     pmids_by_gene_pair[gene_a + '-' + gene_b] = {'pmids': intersection}
@@ -210,8 +316,7 @@ def disease_search(disease=None):
     pmids_by_gene_pair = defaultdict(lambda: {})
 
     # Iterate over each unique pair
-    for gene_a in genes:
-        i = genes.index(gene_a)
+    for i, gene_a in enumerate(genes):
         for l in range(i+1, total_genes):
             gene_b = genes[l]
             _a, _b, results = gene_pair_search(gene_a, gene_b, gene_pmids[gene_a], gene_pmids[gene_b])
@@ -219,35 +324,42 @@ def disease_search(disease=None):
 
     return disease, pmids_by_gene_pair
 
+def article_associations(data):
+    diseases = [disease['key'] for disease in data['diseases']] if 'diseases' in data else []
+    variants = [gene['symbol'] + ':' + variant['key'] for gene in data['genes'] if 'variants' in gene for variant in gene['variants']]
+    return diseases, variants
+
 def aggregate_article_info(pmids_by_gene_pair):
     pmid_info = {}
 
-    for gene_pair, values in pmids_by_gene_pair.items():
-        diseases_by_pmids = defaultdict(lambda: [])
-        variants_by_pmids = defaultdict(lambda: [])
+    # Get article_info for each unique PMID across all gene pairs up front, so
+    # that the requests can run concurrently
+    pmids = list(set(pmid for values in pmids_by_gene_pair.values() for pmid in values['pmids']))
 
-        current = 0
-        total = len(values['pmids'])
+    current = 0
+    total = len(pmids)
+    progress_prefix = 'Inspecting PMID info for ' + str(total) + ' articles:'
 
-        for pmid in values['pmids']:
-            current += 1
-            print_progress(current, total, prefix = 'Inspecting PMID info for ' + str(gene_pair).upper() + ':', suffix = 'Complete', bar_length = 50)
+    for pmid, data in zip(pmids, pool_map(lambda pmid: api_get("article_info", {'pmid': pmid}), pmids)):
+        current += 1
+        print_progress(current, total, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
-            if pmid in pmid_info:
-                data = pmid_info[pmid]
-            else:
-                # Get article_info for each PMID
-                data = api_get("article_info", {'pmid': pmid})
-                pmid_info[pmid] = data
+        # Only keep the diseases and variants from each article, which are
+        # shared by every gene pair citing it
+        pmid_info[pmid] = article_associations(data)
+
+    for gene_pair, values in pmids_by_gene_pair.items():
+        diseases_by_pmids = defaultdict(list)
+        variants_by_pmids = defaultdict(list)
+
+        for pmid in values['pmids']:
+            diseases, variants = pmid_info[pmid]
 
-            if 'diseases' in data:
-                for disease in data['diseases']:
-                    diseases_by_pmids[disease['key']].append(pmid)
+            for disease in diseases:
+                diseases_by_pmids[disease].append(pmid)
 
-            for gene in data['genes']:
-                if 'variants' in gene:
-                    for variant in gene['variants']:
-                        variants_by_pmids[gene['symbol'] + ':' + variant['key']].append(pmid)
+            for variant in variants:
+                variants_by_pmids[variant].append(pmid)
 
         pmids_by_gene_pair[gene_pair]['diseases'] = diseases_by_pmids
         pmids_by_gene_pair[gene_pair]['variants'] = variants_by_pmids
@@ -273,7 +385,7 @@ def main():
         info = aggregate_article_info(info)
 
     output_filename = "-".join([filename_prefix, "gene-fusions", str(_sensitivity), "article-sensitivity"]) + ".txt"
-    with codecs.open(output_filename, 'wb', 'utf-8') as output_file:
+    with open(output_filename, 'w', encoding='utf-8') as output_file:
         for gene_pair, data in info.items():
             if len(data['pmids']) == 0:
                 output_file.write("No articles found with " + str(gene_pair).upper() + "\n")
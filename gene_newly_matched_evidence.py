@@ -47,17 +47,34 @@ True. This will only match articles which contain at least one genetic variant.
 If testing the script or data output, the STOP_AFTER setting may be set to some
 small number (typically 1-5), so that the script will exit and generate the
 output data files after that many genes with non-zero results are found.
+
+If you expect to run this several times over overlapping genes, you may also
+set CACHE_FILE below, so that API responses are saved to disk and reused on
+later runs instead of being fetched again.
 """
 
 import sys
 import re
 import json
+import time
+import shelve
+import atexit
+import threading
 import requests
-import urllib
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from multiprocessing.pool import ThreadPool
+import urllib.parse
 from collections import defaultdict, OrderedDict
 import datetime
-import time
-import codecs
+import calendar
+import csv
+
+# orjson is optional, but parses API responses faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL = "https://mastermind.genomenon.com/api/v2/"
 
@@ -111,17 +128,101 @@ SCORE_WEIGHTS['Matched Genes in Abstract'] = 10
 SCORE_WEIGHTS['Matched Gene Variants in Abstract'] = 10
 SCORE_WEIGHTS['Therapies in Abstract'] = 15
 
-def api_get(endpoint, options, tries=0):
-    params = options.copy()
-    params.update({'api_token': API_TOKEN})
+# To reuse API responses across runs, set this to the path of a file to cache
+# them in, e.g. "mastermind_cache". Delete the file to clear the cache:
+CACHE_FILE = False #"mastermind_cache"
 
-    # print("Querying API: ", endpoint, options)
-    response = requests.get(url=URL+endpoint, params=params)
+# Number of seconds after which a cached API response is fetched again:
+CACHE_EXPIRATION = 24*60*60
+
+# Maximum number of API requests to have in flight at once when fetching pages
+# of articles or article_info:
+MAX_WORKERS = 16
+
+# Number of seconds to wait for the API to respond before retrying a request:
+TIMEOUT = 30
 
-    return json_or_print_error(response, endpoint, options, tries)
+# Retry requests that fail with a temporary server error or rate limit, waiting
+# a little longer before each attempt. Once out of retries, requests that timed
+# out or got an internal server error are skipped.
+RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[408, 429, 500, 502, 503, 504], raise_on_status=False)
+
+# Share one connection pool across all API requests, so that requests reuse
+# open connections instead of making a new one for every call.
+SESSION = requests.Session()
+SESSION.params = {'api_token': API_TOKEN}
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRIES, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+# Size of the write buffer for each output file:
+OUTPUT_BUFFER_SIZE = 1024*1024
+
+_cache = None
+_cache_lock = threading.Lock()
+_responses = {}
+_last_progress = 0
+
+def api_get(endpoint, options):
+    if CACHE_FILE:
+        cache_key = json.dumps([endpoint, sorted(options.items())])
+        data = cache_read(cache_key)
+        if data is not None:
+            return data
+
+    # print("Querying API: ", endpoint, options)
+    try:
+        response = SESSION.get(url=URL+endpoint, params=options, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        # Raised once retries run out without any response, e.g. after the
+        # request kept timing out or the connection kept dropping
+        sys.stdout.write('\n')
+        print("ERROR ENCOUNTERED: " + str(e))
+        print("\tRESULTING FROM REQUEST: " + endpoint)
+        print("\tWITH PARAMS: " + str(options))
+        print("SKIPPING DATA FOR ABOVE REQUEST")
+        return
+
+    data = json_or_print_error(response, endpoint, options)
+
+    # Skipped requests return None, and are tried again on the next run
+    if CACHE_FILE and data is not None:
+        cache_write(cache_key, data)
+    return data
+
+def open_cache():
+    global _cache
+    if _cache is None:
+        _cache = shelve.open(CACHE_FILE)
+        atexit.register(_cache.close)
+    return _cache
+
+def cache_read(key):
+    with _cache_lock:
+        entry = open_cache().get(key)
+    if entry is not None and time.time() - entry[0] < CACHE_EXPIRATION:
+        return entry[1]
+
+def cache_write(key, data):
+    with _cache_lock:
+        open_cache()[key] = (time.time(), data)
+
+def memoized_api_get(endpoint, options):
+    # Gene lists often repeat genes, so only look up each one's suggestions and
+    # counts once per run
+    key = json.dumps([endpoint, sorted(options.items())])
+    if key not in _responses:
+        data = api_get(endpoint, options)
+        if data is None:
+            return data
+        _responses[key] = data
+    return _responses[key]
+
+def since_timestamp(date):
+    # Treat dates as UTC, so that the same BEGIN and END settings give the same
+    # results no matter which time zone the script is run in
+    return calendar.timegm(date.timetuple())
 
 def filtered_params(gene, since):
-    filter_params = {'gene': gene, 'since': int(time.mktime(since.timetuple()))}
+    filter_params = {'gene': gene, 'since': since}
     if FILTER_JOURNALS:
         filter_params['journals[]'] = JOURNALS
     return filter_params
@@ -130,7 +231,15 @@ def skip_article(pmid_data, all_genes):
     return filter_after_published_date(pmid_data) or filter_no_variants(pmid_data, all_genes)
 
 def filter_after_published_date(pmid_data):
-    return FILTER_PUBLISHED_DATE and datetime.datetime.strptime(pmid_data['publication_date'], '%Y-%m-%d') < FILTER_PUBLISHED_DATE
+    if not FILTER_PUBLISHED_DATE:
+        return False
+
+    # Articles are checked more than once, so only parse each date the first
+    # time it's seen
+    published = pmid_data.get('_published')
+    if published is None:
+        published = pmid_data['_published'] = datetime.datetime(*map(int, pmid_data['publication_date'].split('-')))
+    return published < FILTER_PUBLISHED_DATE
 
 def filter_no_variants(pmid_data, all_genes):
     if not ONLY_VARIANTS:
@@ -142,8 +251,10 @@ def filter_no_variants(pmid_data, all_genes):
 
     return True
 
-def json_or_print_error(response, endpoint, options, tries):
+def json_or_print_error(response, endpoint, options):
     if response.status_code == requests.codes.ok:
+        if orjson:
+            return orjson.loads(response.content)
         return response.json()
     else:
         sys.stdout.write('\n')
@@ -153,27 +264,51 @@ def json_or_print_error(response, endpoint, options, tries):
         print("\tRESULTING FROM REQUEST: " + endpoint)
         print("\tWITH PARAMS: " + str(options))
         if response.status_code in [408, 500]:
-            if tries < 1:
-                print("Time out error, trying again.")
-                return api_get(endpoint, options, tries+1)
-            else:
-                print("SKIPPING DATA FOR ABOVE REQUEST")
-                return
+            print("SKIPPING DATA FOR ABOVE REQUEST")
+            return
         sys.exit(0)
 
 def encode(str):
-    if sys.version_info[0] < 3:
-        return urllib.quote_plus(str)
-    else:
-        return urllib.parse.quote_plus(str)
+    return urllib.parse.quote_plus(str)
+
+def pool_map(func, items):
+    # Calls func for each item using a pool of threads, yielding results in
+    # the same order as items. API errors call sys.exit(), which would only
+    # end the worker thread, so hand those back to exit from the main thread.
+    def call(item):
+        try:
+            return False, func(item)
+        except SystemExit as e:
+            return True, e
+
+    pool = ThreadPool(MAX_WORKERS)
+    try:
+        for exited, result in pool.imap(call, items):
+            if exited:
+                raise result
+            yield result
+    finally:
+        pool.terminate()
 
 def print_progress(iteration, total, prefix='', suffix='', decimals=1, bar_length=100):
+    global _last_progress
+    # A progress bar is only useful on a terminal, not when output is
+    # redirected to a file
+    if not sys.stdout.isatty():
+        return
+
+    # Redraw at most 20 times a second, but always draw the finished bar
+    now = time.time()
+    if iteration != total and now - _last_progress < 0.05:
+        return
+    _last_progress = now
+
     str_format = "{0:." + str(decimals) + "f}"
     percents = str_format.format(100 * (iteration / float(total)))
     filled_length = int(round(bar_length * iteration / float(total)))
     bar = 'M' * filled_length + '-' * (bar_length - filled_length)
 
-    sys.stdout.write('\r%s |%s| %s%s %s' % (prefix, bar, percents, '%', suffix)),
+    sys.stdout.write('\r%s |%s| %s%s %s' % (prefix, bar, percents, '%', suffix))
 
     if iteration == total:
         sys.stdout.write('\n')
@@ -187,17 +322,17 @@ def get_articles(options):
         articles = int(data['article_count'])
         pages = int(data['pages'])
 
-        date_string = datetime.datetime.fromtimestamp(options["since"]).strftime('%x')
-        print_progress(1, pages, prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['gene']).upper() + ' since ' + date_string + ':', suffix = 'Complete', bar_length = 50)
+        date_string = time.strftime('%x', time.gmtime(options["since"]))
+        progress_prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['gene']).upper() + ' since ' + date_string + ':'
+        print_progress(1, pages, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
         if pages > 1:
-            for page in range(2, pages+1):
-            # for page in range(2, 3):
-                print_progress(page, pages, prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['gene']).upper() + ' since ' + date_string + ':', suffix = 'Complete', bar_length = 50)
+            # Page count is known after the first page, so fetch the rest concurrently
+            page_params = [dict(options, page=page) for page in range(2, pages+1)]
+            for page, data in enumerate(pool_map(lambda page_options: api_get("articles", page_options), page_params), 2):
+                print_progress(page, pages, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
-                options.update({'page': page})
-                data = api_get("articles", options)
-                pmids = pmids + [article['pmid'] for article in data['articles']]
+                pmids.extend(article['pmid'] for article in data['articles'])
     else:
         pmids = []
 
@@ -239,11 +374,30 @@ def score_article(match_data):
 
     return scores
 
+# Every disease, phenotype and therapy collects the same fields, so create them
+# all up front rather than on first use
+LINKED_INFO_FIELDS = ('pmids', 'diseases', 'phenotypes', 'therapies', 'matched_genes', 'other_genes', 'matched_gene_variants', 'other_gene_variants')
+
+def new_linked_info():
+    return dict((field, set()) for field in LINKED_INFO_FIELDS)
+
 def aggregate_article_info(gene_info, all_genes):
     article_info = {}
-    disease_info = defaultdict(lambda: defaultdict(lambda: set([])))
-    phenotype_info = defaultdict(lambda: defaultdict(lambda: set([])))
-    therapy_info = defaultdict(lambda: defaultdict(lambda: set([])))
+    disease_info = {}
+    phenotype_info = {}
+    therapy_info = {}
+    passed_pmids = set()
+
+    # Get article_info for each unique PMID across all genes up front, so that
+    # articles shared by several genes are only requested once and all the
+    # requests can run concurrently
+    pmids = list(set(pmid for values in gene_info.values() for pmid in values['pmids']))
+    fetched_article_info = {}
+    progress_prefix = 'Getting PMID info for ' + str(len(pmids)) + ' articles:'
+
+    for fetched, (pmid, data) in enumerate(zip(pmids, pool_map(lambda pmid: api_get("article_info", {'pmid': pmid}), pmids)), 1):
+        print_progress(fetched, len(pmids), prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
+        fetched_article_info[pmid] = data
 
     for gene, values in gene_info.items():
         pmids_by_disease = defaultdict(lambda: [])
@@ -254,19 +408,22 @@ def aggregate_article_info(gene_info, all_genes):
 
         current = 0
         total = len(values['pmids'])
+        progress_prefix = 'Inspecting PMID info for ' + str(gene).upper() + ':'
+        # Canonical gene names aren't always lowercase, so compare article
+        # gene symbols against this gene the same way as against all_genes
+        gene_lower = gene.lower()
 
         gene_info[gene]['filtered_pmids'] = []
 
         for pmid in values['pmids']:
             current += 1
-            print_progress(current, total, prefix = 'Inspecting PMID info for ' + str(gene).upper() + ':', suffix = 'Complete', bar_length = 50)
+            print_progress(current, total, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
             if pmid in article_info:
                 data = article_info[pmid]
                 process_article = False
             else:
-                # Get article_info for each PMID
-                data = api_get("article_info", {'pmid': pmid})
+                data = fetched_article_info.get(pmid)
                 # If request fails, it already prints to stdout that the PMID
                 # is getting skipped, so we can just continue to next PMID
                 if not data:
@@ -284,132 +441,109 @@ def aggregate_article_info(gene_info, all_genes):
                 continue
 
             gene_info[gene]['filtered_pmids'].append(pmid)
-
-            if 'diseases' in data:
-                for disease in data['diseases']:
-                    pmids_by_disease[disease['key']].append(pmid)
-
-                    disease_info[disease['key']]['pmids'].add(pmid)
-
-                    for other_disease in data['diseases']:
-                        if other_disease['key'] != disease['key']:
-                            disease_info[disease['key']]["diseases"].add(other_disease['key'])
-
-            if 'hpo_terms' in data:
-                for phenotype in data['hpo_terms']:
-                    pmids_by_phenotype[phenotype['term']].append(pmid)
-                    phenotype_info[phenotype['term']]['pmids'].add(pmid)
-                    phenotype_info[phenotype['term']]['id'] = phenotype['key']
-
-                    if 'diseases' in data:
-                        for disease in data['diseases']:
-                            disease_info[disease['key']]["phenotypes"].add(phenotype['term'])
-                            phenotype_info[phenotype['term']]['diseases'].add(disease['key'])
-
-                    for other_phenotype in data['hpo_terms']:
-                        if other_phenotype['term'] != phenotype['term']:
-                            phenotype_info[phenotype['term']]["phenotypes"].add(other_phenotype['term'])
-
-            if 'unii_terms' in data:
-                for therapy in data['unii_terms']:
-                    pmids_by_therapy[therapy['term']].append(pmid)
-                    therapy_info[therapy['term']]['pmids'].add(pmid)
-                    therapy_info[therapy['term']]['id'] = therapy['key']
-
-                    if 'diseases' in data:
-                        for disease in data['diseases']:
-                            disease_info[disease['key']]["therapies"].add(therapy['term'])
-                            therapy_info[therapy['term']]['diseases'].add(disease['key'])
-
-                    if 'hpo_terms' in data:
-                        for phenotype in data['hpo_terms']:
-                            phenotype_info[phenotype['term']]["therapies"].add(therapy['term'])
-                            therapy_info[therapy['term']]['phenotypes'].add(phenotype['term'])
-
-                    for other_therapy in data['unii_terms']:
-                        if other_therapy['term'] != therapy['term']:
-                            therapy_info[therapy['term']]["therapies"].add(other_therapy['term'])
+            passed_pmids.add(pmid)
+
+            article_diseases = data.get('diseases') or ()
+            article_phenotypes = data.get('hpo_terms') or ()
+            article_therapies = data.get('unii_terms') or ()
+
+            disease_keys = set(disease['key'] for disease in article_diseases)
+            phenotype_terms = set(phenotype['term'] for phenotype in article_phenotypes)
+            therapy_terms = set(therapy['term'] for therapy in article_therapies)
+
+            for disease in article_diseases:
+                key = disease['key']
+                pmids_by_disease[key].append(pmid)
+
+                info = disease_info.get(key)
+                if info is None:
+                    info = disease_info[key] = new_linked_info()
+                info['pmids'].add(pmid)
+                info["diseases"].update(disease_keys - set([key]))
+                info["phenotypes"].update(phenotype_terms)
+                info["therapies"].update(therapy_terms)
+
+            for phenotype in article_phenotypes:
+                term = phenotype['term']
+                pmids_by_phenotype[term].append(pmid)
+
+                info = phenotype_info.get(term)
+                if info is None:
+                    info = phenotype_info[term] = new_linked_info()
+                info['pmids'].add(pmid)
+                info['id'] = phenotype['key']
+                info['diseases'].update(disease_keys)
+                info["phenotypes"].update(phenotype_terms - set([term]))
+                info["therapies"].update(therapy_terms)
+
+            for therapy in article_therapies:
+                term = therapy['term']
+                pmids_by_therapy[term].append(pmid)
+
+                info = therapy_info.get(term)
+                if info is None:
+                    info = therapy_info[term] = new_linked_info()
+                info['pmids'].add(pmid)
+                info['id'] = therapy['key']
+                info['diseases'].update(disease_keys)
+                info['phenotypes'].update(phenotype_terms)
+                info["therapies"].update(therapy_terms - set([term]))
+
+            # Genes and variants in the article, to link to each of its
+            # diseases, phenotypes and therapies below
+            linked = {'matched_genes': set(), 'other_genes': set(), 'matched_gene_variants': set(), 'other_gene_variants': set()}
 
             for pmid_gene in data['genes']:
-                if pmid_gene['symbol'].lower() in all_genes:
-                    if process_article:
-                        article_info[pmid]['matched_genes'].append(pmid_gene['symbol'])
+                symbol = pmid_gene['symbol']
+                symbol_lower = symbol.lower()
+                matched = symbol_lower in all_genes
 
-                    if 'unii_terms' in data:
-                        for therapy in data['unii_terms']:
-                            therapy_info[therapy['term']]["matched_genes"].add(pmid_gene['symbol'])
-
-                    if 'hpo_terms' in data:
-                        for phenotype in data['hpo_terms']:
-                            phenotype_info[phenotype['term']]["matched_genes"].add(pmid_gene['symbol'])
+                if matched:
+                    if process_article:
+                        article_info[pmid]['matched_genes'].append(symbol)
 
-                    if 'diseases' in data:
-                        for disease in data['diseases']:
-                            disease_info[disease['key']]['matched_genes'].add(pmid_gene['symbol'])
+                    linked['matched_genes'].add(symbol)
                 else:
                     if process_article:
-                        article_info[pmid]['other_genes'].append(pmid_gene['symbol'])
-
-                    if 'unii_terms' in data:
-                        for therapy in data['unii_terms']:
-                            therapy_info[therapy['term']]["other_genes"].add(pmid_gene['symbol'])
-
-                    if 'hpo_terms' in data:
-                        for phenotype in data['hpo_terms']:
-                            phenotype_info[phenotype['term']]["other_genes"].add(pmid_gene['symbol'])
+                        article_info[pmid]['other_genes'].append(symbol)
 
-                    if 'diseases' in data:
-                        for disease in data['diseases']:
-                            disease_info[disease['key']]['other_genes'].add(pmid_gene['symbol'])
+                    linked['other_genes'].add(symbol)
 
-                if pmid_gene['symbol'].lower() != gene:
-                    if pmid_gene['symbol'].lower() in all_genes:
-                        pmids_by_gene['matched_genes'][pmid_gene['symbol']].append(pmid)
+                if symbol_lower != gene_lower:
+                    if matched:
+                        pmids_by_gene['matched_genes'][symbol].append(pmid)
                     else:
-                        pmids_by_gene['other_genes'][pmid_gene['symbol']].append(pmid)
-
-                if 'variants' in pmid_gene:
-                    for variant in pmid_gene['variants']:
-                        variant_name = pmid_gene['symbol'] + ':' + variant['key']
-
-                        if pmid_gene['symbol'].lower() in all_genes:
-                            if process_article:
-                                article_info[pmid]['matched_gene_variants'].append(variant_name)
-
-                            if pmid_gene['symbol'].lower() == gene:
-                                pmids_by_variant['gene_variants'][variant_name].append(pmid)
-                            else:
-                                pmids_by_variant['matched_gene_variants'][variant_name].append(pmid)
+                        pmids_by_gene['other_genes'][symbol].append(pmid)
 
-                            if 'unii_terms' in data:
-                                for therapy in data['unii_terms']:
-                                    therapy_info[therapy['term']]["matched_gene_variants"].add(variant_name)
+                for variant in pmid_gene.get('variants') or ():
+                    variant_name = symbol + ':' + variant['key']
 
-                            if 'hpo_terms' in data:
-                                for phenotype in data['hpo_terms']:
-                                    phenotype_info[phenotype['term']]["matched_gene_variants"].add(variant_name)
-
-                            if 'diseases' in data:
-                                for disease in data['diseases']:
-                                    disease_info[disease['key']]['matched_gene_variants'].add(variant_name)
+                    if matched:
+                        if process_article:
+                            article_info[pmid]['matched_gene_variants'].append(variant_name)
 
+                        if symbol_lower == gene_lower:
+                            pmids_by_variant['gene_variants'][variant_name].append(pmid)
                         else:
-                            if process_article:
-                                article_info[pmid]['other_gene_variants'].append(variant_name)
+                            pmids_by_variant['matched_gene_variants'][variant_name].append(pmid)
 
-                            pmids_by_variant['other_gene_variants'][variant_name].append(pmid)
+                        linked['matched_gene_variants'].add(variant_name)
+                    else:
+                        if process_article:
+                            article_info[pmid]['other_gene_variants'].append(variant_name)
 
-                            if 'unii_terms' in data:
-                                for therapy in data['unii_terms']:
-                                    therapy_info[therapy['term']]["other_gene_variants"].add(variant_name)
+                        pmids_by_variant['other_gene_variants'][variant_name].append(pmid)
 
-                            if 'hpo_terms' in data:
-                                for phenotype in data['hpo_terms']:
-                                    phenotype_info[phenotype['term']]["other_gene_variants"].add(variant_name)
+                        linked['other_gene_variants'].add(variant_name)
 
-                            if 'diseases' in data:
-                                for disease in data['diseases']:
-                                    disease_info[disease['key']]['other_gene_variants'].add(variant_name)
+            for field, names in linked.items():
+                if names:
+                    for disease in disease_keys:
+                        disease_info[disease][field].update(names)
+                    for phenotype in phenotype_terms:
+                        phenotype_info[phenotype][field].update(names)
+                    for therapy in therapy_terms:
+                        therapy_info[therapy][field].update(names)
 
         gene_info[gene]['diseases'] = pmids_by_disease
         gene_info[gene]['phenotypes'] = pmids_by_phenotype
@@ -417,10 +551,17 @@ def aggregate_article_info(gene_info, all_genes):
         gene_info[gene]['genes'] = pmids_by_gene
         gene_info[gene]['variants'] = pmids_by_variant
 
+    # Only pass on the articles that made it through the filters, so they don't
+    # need checking again when scoring and writing them out
+    article_info = {pmid: data for pmid, data in article_info.items() if pmid in passed_pmids}
+
     return gene_info, article_info, disease_info, phenotype_info, therapy_info
 
+# Matches the gene parameter of an article's Mastermind link
+_GENE_RE = re.compile(r'([&\?])gene=[^&]+')
+
 def pipe_delimited_field(values):
-    return "\"" + re.sub(r"\"", "\"\"", "|".join(values)) + "\""
+    return "|".join(values)
 
 def main(args):
     print("Welcome to the Gene New Evidence Alerts program powered by Mastermind.")
@@ -428,6 +569,11 @@ def main(args):
     filename = args[1]
     genes_with_articles = 0
     gene_info = {}
+    looked_up_genes = set()
+
+    # Convert the date filters to timestamps once, rather than for every request
+    begin_since = since_timestamp(BEGIN)
+    end_since = None if END == None else since_timestamp(END)
 
     with open(filename, "r") as lines:
         # Loop through lines in gene input file
@@ -435,42 +581,57 @@ def main(args):
             if STOP_AFTER and genes_with_articles > STOP_AFTER:
                 break
             gene_input = line.strip()
-            gene_data = api_get("suggestions", {'gene': gene_input})
+            if not gene_input:
+                continue
+            gene_data = memoized_api_get("suggestions", {'gene': gene_input})
             if len(gene_data) > 0:
                 canonical_gene = gene_data[0]['canonical']
             else:
                 print("No suggestions found for " + gene_input)
                 continue
 
-            begin_count = api_get("counts", filtered_params(canonical_gene, BEGIN))
+            # Genes listed more than once, or under more than one name, only
+            # need their articles fetched once
+            if canonical_gene in looked_up_genes:
+                continue
+            looked_up_genes.add(canonical_gene)
+
+            begin_params = filtered_params(canonical_gene, begin_since)
+            end_params = None if END == None else filtered_params(canonical_gene, end_since)
+
+            begin_count = memoized_api_get("counts", begin_params)
             if END == None:
                 end_count = {'article_count': 0}
             else:
-                end_count = api_get("counts", filtered_params(canonical_gene, END))
+                end_count = memoized_api_get("counts", end_params)
 
             period_count = begin_count["article_count"] - end_count["article_count"]
 
-            print canonical_gene + " has " + str(period_count) + " article(s)"
+            print(canonical_gene + " has " + str(period_count) + " article(s)")
             if period_count > 0:
                 genes_with_articles += 1
 
                 if ONLY_VARIANTS:
-                    variants = api_get("variants", filtered_params(canonical_gene, BEGIN))
+                    variants = memoized_api_get("variants", begin_params)
                     print("Found " + str(variants["variant_count"]) + " variants")
 
                 if (not ONLY_VARIANTS) or variants["variant_count"] > 0:
-                    begin_pmids = get_articles(filtered_params(canonical_gene, BEGIN))
-                    if END == None:
-                        end_pmids = []
+                    begin_pmids = get_articles(begin_params)
+                    # No need to page through the articles since END when the
+                    # count already says there aren't any
+                    if END == None or end_count["article_count"] == 0:
+                        end_pmids = set()
                     else:
-                        end_pmids = get_articles(filtered_params(canonical_gene, END))
+                        end_pmids = set(get_articles(end_params))
 
                     period_pmids = [item for item in begin_pmids if item not in end_pmids]
 
                     gene_info[canonical_gene] = {'pmids': period_pmids}
 
     # Aggregate all article info, from which other aggregations will be generated
-    all_genes = gene_info.keys()
+    # Article gene symbols are lowercased before checking them against this, so
+    # make sure the input genes are lowercase too
+    all_genes = frozenset(gene.lower() for gene in gene_info)
     gene_info, article_info, disease_info, phenotype_info, therapy_info = aggregate_article_info(gene_info, all_genes)
 
     if INCLUDE_SCORE or INCLUDE_SUBSCORES:
@@ -480,9 +641,6 @@ def main(args):
         for pmid, article in article_info.items():
             current += 1
             print_progress(current, total, prefix = 'Calculating scores for articles', suffix = 'Complete', bar_length = 50)
-            if skip_article(article, all_genes):
-                continue
-
             article_info[pmid]['scores'] = score_article(article)
             article_info[pmid]['total_score'] = combine_and_weight(article_info[pmid]['scores'])
 
@@ -491,7 +649,8 @@ def main(args):
     # Save relevant article data for each unique article across the input gene set to articles.csv file
     articles_file_path = filename + ".articles.csv"
     print("Article info in " + articles_file_path)
-    with codecs.open(articles_file_path, 'wb', 'utf-8') as output_file:
+    with open(articles_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
         columns = ["PMID", "Link", "Journal", "Title", "Publication Date", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Phenotypes", "Therapies"]
 
         if INCLUDE_SCORE:
@@ -500,12 +659,9 @@ def main(args):
             score_columns = list(SCORE_WEIGHTS.keys())
             columns += score_columns
 
-        output_file.write(",".join(columns) + "\n")
+        writer.writerow(columns)
         for pmid, article in article_info.items():
-            if skip_article(article, all_genes):
-                continue
-
-            url = re.sub(r'([&\?])gene=[^&]+', r'\1gene=' + encode(article["matched_genes"][0]), article["url"])
+            url = _GENE_RE.sub(r'\1gene=' + encode(article["matched_genes"][0]), article["url"])
             pmid_diseases = []
             pmid_phenotypes = []
             pmid_genes = []
@@ -534,48 +690,52 @@ def main(args):
             if INCLUDE_SUBSCORES:
                 fields += [[str(round(article['scores'][score_name], 2))] for score_name in score_columns]
 
-            output_file.write(",".join([pipe_delimited_field(field) for field in fields]) + "\n")
+            writer.writerow([pipe_delimited_field(field) for field in fields])
 
     print('-'*100)
 
     # Save relevant article data, organized by unique diseases to diseases.csv
     diseases_file_path = filename + ".diseases.csv"
     print("Disease info in " + diseases_file_path)
-    with codecs.open(diseases_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["Disease", "Link", "PMIDs", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Other Diseases", "Phenotypes", "Therapies"]) + "\n")
+    with open(diseases_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["Disease", "Link", "PMIDs", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Other Diseases", "Phenotypes", "Therapies"])
         for disease, info in disease_info.items():
             url = "https://mastermind.genomenon.com/detail?gene=" + encode(next(iter(info["matched_genes"]))) + "&disease=" + encode(disease)
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[disease], [url], info["pmids"], info["matched_genes"], info["other_genes"], info["matched_gene_variants"], info["other_gene_variants"], info["diseases"], info["phenotypes"], info["therapies"]]]) + "\n")
+            writer.writerow([pipe_delimited_field(field) for field in [[disease], [url], info["pmids"], info["matched_genes"], info["other_genes"], info["matched_gene_variants"], info["other_gene_variants"], info["diseases"], info["phenotypes"], info["therapies"]]])
 
     print('-'*100)
 
     # Save relevant article data, organized by unique phenotypes to phenotypes.csv
     phenotypes_file_path = filename + ".phenotypes.csv"
     print("Phenotype info in " + phenotypes_file_path)
-    with codecs.open(phenotypes_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["Phenotype", "Link", "PMIDs", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Other Phenotypes", "Therapies"]) + "\n")
+    with open(phenotypes_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["Phenotype", "Link", "PMIDs", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Other Phenotypes", "Therapies"])
         for phenotype, info in phenotype_info.items():
             url = "https://mastermind.genomenon.com/detail?gene=" + encode(next(iter(info["matched_genes"]))) + "&hpo=" + encode(info["id"])
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[phenotype], [url], info["pmids"], info["matched_genes"], info["other_genes"], info["matched_gene_variants"], info["other_gene_variants"], info["diseases"], info["phenotypes"], info["therapies"]]]) + "\n")
+            writer.writerow([pipe_delimited_field(field) for field in [[phenotype], [url], info["pmids"], info["matched_genes"], info["other_genes"], info["matched_gene_variants"], info["other_gene_variants"], info["diseases"], info["phenotypes"], info["therapies"]]])
 
     print('-'*100)
 
     # Save relevant article data, organized by unique phenotypes to phenotypes.csv
     therapies_file_path = filename + ".therapies.csv"
     print("Therapy info in " + therapies_file_path)
-    with codecs.open(therapies_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["Therapy", "Link", "PMIDs", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Phenotypes", "Other Therapies"]) + "\n")
+    with open(therapies_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["Therapy", "Link", "PMIDs", "Matched Genes", "Other Genes", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Phenotypes", "Other Therapies"])
         for therapy, info in therapy_info.items():
             url = "https://mastermind.genomenon.com/detail?gene=" + encode(next(iter(info["matched_genes"]))) + "&unii=" + encode(info["id"])
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[therapy], [url], info["pmids"], info["matched_genes"], info["other_genes"], info["matched_gene_variants"], info["other_gene_variants"], info["diseases"], info["phenotypes"], info["therapies"]]]) + "\n")
+            writer.writerow([pipe_delimited_field(field) for field in [[therapy], [url], info["pmids"], info["matched_genes"], info["other_genes"], info["matched_gene_variants"], info["other_gene_variants"], info["diseases"], info["phenotypes"], info["therapies"]]])
 
     print('-'*100)
 
     # Save relevant article data, organized by unique genes from input gene set to genes.csv
     genes_file_path = filename + ".genes.csv"
     print("Gene info in " + genes_file_path)
-    with codecs.open(genes_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["Gene", "Link", "PMIDs", "Matched Genes", "Other Genes", "Gene Variants", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Phenotypes", "Therapies"]) + "\n")
+    with open(genes_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["Gene", "Link", "PMIDs", "Matched Genes", "Other Genes", "Gene Variants", "Matched Gene Variants", "Other Gene Variants", "Diseases", "Phenotypes", "Therapies"])
         for gene, info in gene_info.items():
             url = "https://mastermind.genomenon.com/detail?gene=" + encode(gene)
             gene_diseases = [gene_disease for gene_disease in info["diseases"].keys()]
@@ -586,14 +746,14 @@ def main(args):
             gene_variants = [gene_variant for gene_variant in info["variants"]["gene_variants"].keys()]
             matched_gene_variants = [gene_variant for gene_variant in info["variants"]["matched_gene_variants"].keys()]
             other_gene_variants = [gene_variant for gene_variant in info["variants"]["other_gene_variants"].keys()]
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[gene], [url], info["filtered_pmids"], matched_genes, other_genes, gene_variants, matched_gene_variants, other_gene_variants, gene_diseases, gene_phenotypes, gene_therapies]]) + "\n")
+            writer.writerow([pipe_delimited_field(field) for field in [[gene], [url], info["filtered_pmids"], matched_genes, other_genes, gene_variants, matched_gene_variants, other_gene_variants, gene_diseases, gene_phenotypes, gene_therapies]])
 
     print('-'*100)
 
     # Save structured associations lists for input gene set to associations.txt
     associations_file_path = filename + ".associations.txt"
     print("Association info in " + associations_file_path)
-    with codecs.open(associations_file_path, 'wb', 'utf-8') as output_file:
+    with open(associations_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
         for gene, data in gene_info.items():
             if len(data['filtered_pmids']) == 0:
                 qualifier = '' if len(data['pmids']) == 0 else ' and filters'
@@ -20,17 +20,66 @@ If you would like to save the results, just direct the output to the desired
 output filename (be careful, this command will overwrite the specified file if
 it already exists):
     ./gene_variant_disease_counts_csv.py "/path/to/input_file.vcf" "melanoma" > output_file.csv
+
+If you expect to run this several times over overlapping variants, you may also
+set CACHE_FILE below, so that API responses are saved to disk and reused on
+later runs instead of being fetched again.
 """
 
 import sys
-import re
-import urllib
+import csv
+import json
+import time
+import shelve
+import atexit
+import threading
+try:
+    from urllib.parse import quote_plus
+except ImportError:
+    from urllib import quote_plus
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from multiprocessing.pool import ThreadPool
+
+# orjson is optional, but parses API responses faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL = "https://mastermind.genomenon.com/api/v2/"
 # Find your API token by logging in, visiting https://mastermind.genomenon.com/api, and clicking the link that says "Click here to fetch your API token".
 API_TOKEN = "INSERT API TOKEN HERE"
 
+# To reuse API responses across runs, set this to the path of a file to cache
+# them in, e.g. "mastermind_cache". Delete the file to clear the cache:
+CACHE_FILE = False #"mastermind_cache"
+
+# Number of seconds after which a cached API response is fetched again:
+CACHE_EXPIRATION = 24*60*60
+
+# Maximum number of variants to look up in the API at once.
+MAX_WORKERS = 16
+
+# Number of seconds to wait for the API to respond before retrying a request:
+TIMEOUT = 30
+
+# Retry requests that fail with a temporary server error or rate limit, waiting
+# a little longer before each attempt. Once out of retries, the last error
+# response is printed as usual.
+RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[408, 429, 500, 502, 503, 504], raise_on_status=False)
+
+# Share one connection pool across all API requests, so that requests reuse
+# open connections instead of making a new one for every call.
+SESSION = requests.Session()
+SESSION.params = {'api_token': API_TOKEN}
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRIES, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+_cache = None
+_cache_lock = threading.Lock()
+_gene_info = {}
+
 GRCH37_ACCESSION_NUMBERS = {
         '1': 'NC_000001.10',
         '2': 'NC_000002.11',
@@ -59,16 +108,49 @@ GRCH37_ACCESSION_NUMBERS = {
         }
 
 def api_get(endpoint, options):
-    params = options.copy()
-    params.update({'api_token': API_TOKEN})
+    if CACHE_FILE:
+        cache_key = json.dumps([endpoint, sorted(options.items())])
+        data = cache_read(cache_key)
+        if data is not None:
+            return data
 
     # print("Querying API: ", endpoint, options)
-    response = requests.get(url=URL+endpoint, params=params)
-
-    return json_or_print_error(response)
+    try:
+        response = SESSION.get(url=URL+endpoint, params=options, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        # Raised once retries run out without any response, e.g. after the
+        # request kept timing out. Report it alongside the skipped variant
+        # messages, rather than in the CSV output.
+        sys.stderr.write(str(e) + "\n")
+        sys.stderr.flush()
+        return
+
+    data = json_or_print_error(response)
+    if CACHE_FILE:
+        cache_write(cache_key, data)
+    return data
+
+def open_cache():
+    global _cache
+    if _cache is None:
+        _cache = shelve.open(CACHE_FILE)
+        atexit.register(_cache.close)
+    return _cache
+
+def cache_read(key):
+    with _cache_lock:
+        entry = open_cache().get(key)
+    if entry is not None and time.time() - entry[0] < CACHE_EXPIRATION:
+        return entry[1]
+
+def cache_write(key, data):
+    with _cache_lock:
+        open_cache()[key] = (time.time(), data)
 
 def json_or_print_error(response):
     if response.status_code == requests.codes.ok:
+        if orjson:
+            return orjson.loads(response.content)
         return response.json()
     elif response.status_code == requests.codes.not_found:
         return {'article_count': 0}
@@ -79,16 +161,77 @@ def json_or_print_error(response):
         sys.exit(0)
 
 def encode(str):
-    if sys.version_info[0] < 3:
-        return urllib.quote_plus(str)
+    return quote_plus(str)
+
+def pool_map(func, items):
+    # Calls func for each item using a pool of threads, yielding results in
+    # the same order as items. API errors call sys.exit(), which would only
+    # end the worker thread, so hand those back to exit from the main thread.
+    def call(item):
+        try:
+            return False, func(item)
+        except SystemExit as e:
+            return True, e
+
+    pool = ThreadPool(MAX_WORKERS)
+    try:
+        for exited, result in pool.imap(call, items):
+            if exited:
+                raise result
+            yield result
+    finally:
+        pool.terminate()
+
+def fetch_gene_info(canonical_gene, canonical_disease):
+    # Many variants share a gene, so only look up each gene's counts once. Two
+    # threads may occasionally fetch the same gene at once, which is harmless.
+    key = (canonical_gene, canonical_disease)
+    if key not in _gene_info:
+        gene_count_data = api_get("counts", {'gene': canonical_gene})
+        gene_disease_count_data = api_get("counts", {'gene': canonical_gene, 'disease': canonical_disease})
+
+        gene_diseases_with_counts = []
+        gene_disease_data = api_get("diseases", {'gene': canonical_gene})
+
+        if gene_count_data is None or gene_disease_count_data is None or gene_disease_data is None:
+            return
+
+        if 'diseases' in gene_disease_data:
+            for disease in gene_disease_data['diseases']:
+                gene_diseases_with_counts.append(str(disease['key']) + "(" + str(disease['article_count']) + ")")
+
+        _gene_info[key] = (gene_count_data, gene_disease_count_data, gene_diseases_with_counts)
+    return _gene_info[key]
+
+def hgvs_variant(chrom, pos, ref, alt):
+    if ref == '.':
+        ref = ''
+    if alt == '.':
+        alt = ''
+
+    prefix = GRCH37_ACCESSION_NUMBERS.get(chrom, chrom) + ':g.' + pos
+    if len(ref) == 1 and len(alt) == 1:
+        return prefix + ref + '>' + alt
+    elif len(ref) == 0:
+        return prefix + 'ins' + alt
+    elif len(ref) > 1:
+        prefix += '_' + str(int(pos) + len(ref)-1)
+
+    if len(alt) == 0:
+        return prefix + 'del'
     else:
-        return urllib.parse.quote_plus(str)
+        return prefix + 'delins' + alt
 
 def generate_lines(variant, canonical_disease):
     lines = []
 
     variant_data = api_get("suggestions", {'variant': variant})
 
+    if variant_data is None:
+        sys.stderr.write("Variant " + variant + " could not be looked up. Skipping.\n")
+        sys.stderr.flush()
+        return []
+
     if len(variant_data) == 0:
         sys.stderr.write("Variant " + variant + " not found. Skipping.\n")
         sys.stderr.flush()
@@ -107,36 +250,30 @@ def generate_lines(variant, canonical_disease):
         new_line.append(match['url'])
 
         variant_disease_count_data = api_get("counts", {'variant': canonical_variant, 'disease': canonical_disease})
-        new_line.append(str(variant_disease_count_data['article_count']))
-
         variant_count_data = api_get("counts", {'variant': canonical_variant})
+        variant_disease_data = api_get("diseases", {'variant': canonical_variant})
+        gene_info = fetch_gene_info(canonical_gene, canonical_disease)
+
+        if variant_disease_count_data is None or variant_count_data is None or variant_disease_data is None or gene_info is None:
+            sys.stderr.write("Variant " + canonical_variant + " could not be looked up. Skipping.\n")
+            sys.stderr.flush()
+            continue
+
+        new_line.append(str(variant_disease_count_data['article_count']))
         new_line.append(str(variant_count_data['article_count']))
 
         variant_diseases_with_counts = []
-        variant_disease_data = api_get("diseases", {'variant': canonical_variant})
-
         if 'diseases' in variant_disease_data:
             for disease in variant_disease_data['diseases']:
                 variant_diseases_with_counts.append(str(disease['key']) + "(" + str(disease['article_count']) + ")")
 
-        new_line.append('"' + '|'.join(variant_diseases_with_counts) + '"')
+        new_line.append('|'.join(variant_diseases_with_counts))
 
-        gene_count_data = api_get("counts", {'gene': canonical_gene})
+        gene_count_data, gene_disease_count_data, gene_diseases_with_counts = gene_info
         new_line.append(gene_count_data['url'])
-
-        gene_disease_count_data = api_get("counts", {'gene': canonical_gene, 'disease': canonical_disease})
         new_line.append(str(gene_disease_count_data['article_count']))
-
         new_line.append(str(gene_count_data['article_count']))
-
-        gene_diseases_with_counts = []
-        gene_disease_data = api_get("diseases", {'gene': canonical_gene})
-
-        if 'diseases' in gene_disease_data:
-            for disease in gene_disease_data['diseases']:
-                gene_diseases_with_counts.append(str(disease['key']) + "(" + str(disease['article_count']) + ")")
-
-        new_line.append('"' + '|'.join(gene_diseases_with_counts) + '"')
+        new_line.append('|'.join(gene_diseases_with_counts))
 
         lines.append(new_line)
 
@@ -145,54 +282,38 @@ def generate_lines(variant, canonical_disease):
 def main(args):
     filename = args[1]
     disease = args[2]
-    output = []
 
     disease_data = api_get("suggestions", {'disease': disease})
+    if disease_data is None:
+        sys.exit(0)
     canonical_disease = disease_data[0]['canonical']
     encoded_disease = encode(canonical_disease)
 
-    output.append(["SYMBOL", "Variant", "MM Code", "MM Variant Link", "Variant " + "\"" + re.sub(r"\"", "\"\"", canonical_disease) + "\"" + " Articles in MM (Article Count", "Variant Article Count in MM", "Variant Diseases in MM (Article Count)", "MM Gene Link", "Gene " + canonical_disease + " Articles in MM (Article Count)", "Gene Article Count in MM", "Gene Diseases in MM (Article Count)"])
+    # Let the csv module quote any fields that contain commas or quotes
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(["SYMBOL", "Variant", "MM Code", "MM Variant Link", "Variant \"" + canonical_disease + "\" Articles in MM (Article Count", "Variant Article Count in MM", "Variant Diseases in MM (Article Count)", "MM Gene Link", "Gene " + canonical_disease + " Articles in MM (Article Count)", "Gene Article Count in MM", "Gene Diseases in MM (Article Count)"])
 
+    variants = []
     with open(filename, "r") as lines:
         readlines = False
         for line in lines:
             if readlines:
-                out = re.split(r'\t', line)
-                chrom, pos, ref, alt, data = out[0], out[1], out[3], out[4], out[7]
-                if ref == '.':
-                    ref = ''
-                if alt == '.':
-                    alt = ''
-
-                if chrom in GRCH37_ACCESSION_NUMBERS:
-                    accession = GRCH37_ACCESSION_NUMBERS[chrom]
-                else:
-                    accession = chrom
-                variant = accession + ':g.' + pos
-                if len(ref) == 1 and len(alt) == 1:
-                    variant += ref + '>'
-                elif len(ref) == 0:
-                    variant += 'ins'
-                else:
-                    if len(ref) > 1:
-                        variant += '_' + str(int(pos) + len(ref)-1)
-
-                    if len(alt) == 0:
-                        variant += 'del'
-                    else:
-                        variant += 'delins'
-                variant += alt
-
-                lines = generate_lines(variant, canonical_disease)
-                for line in lines:
-                    output.append(line)
+                # Only the first five columns are needed, so don't split up
+                # the rest of the line
+                chrom, pos, _, ref, alt = line.split('\t', 5)[:5]
+                variants.append(hgvs_variant(chrom, pos, ref, alt))
 
             else:
-                if line.find("#CHROM") == 0:
+                if line.startswith("#CHROM"):
                     readlines = True
 
-    for line in output:
-        print ','.join(line)
+    # Each variant's lookups are independent, so run them concurrently while
+    # keeping the output rows in the same order as the input VCF. Write each
+    # variant's rows as soon as they're ready, so they show up while the rest
+    # are still being looked up.
+    for lines in pool_map(lambda variant: generate_lines(variant, canonical_disease), variants):
+        writer.writerows(lines)
+        sys.stdout.flush()
 
 if __name__ == "__main__":
     main(sys.argv)
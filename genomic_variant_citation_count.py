@@ -14,18 +14,102 @@ Then run the file directly from the command line:
 
 You will be prompted to type in the HGVS genomic coordinate description of the
 desired variant and hit Enter.
+
+If you expect to look up the same variants again, you may also set CACHE_FILE
+below, so that API responses are saved to disk and reused on later runs instead
+of being fetched again.
 """
 
 import sys
-import urllib
+import json
+import time
+import shelve
+import atexit
+import threading
+import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from multiprocessing.pool import ThreadPool
+
+# orjson is optional, but parses API responses faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL = "https://mastermind.genomenon.com/api/v2/"
 # Find your API token by logging in, visiting https://mastermind.genomenon.com/api, and clicking the link that says "Click here to fetch your API token".
 API_TOKEN = "INSERT API TOKEN HERE"
 
+# To reuse API responses across runs, set this to the path of a file to cache
+# them in, e.g. "mastermind_cache". Delete the file to clear the cache:
+CACHE_FILE = False #"mastermind_cache"
+
+# Number of seconds after which a cached API response is fetched again:
+CACHE_EXPIRATION = 24*60*60
+
+# Maximum number of effects to look up in the API at once.
+MAX_WORKERS = 16
+
+# Number of seconds to wait for the API to respond before retrying a request:
+TIMEOUT = 30
+
+# Retry requests that fail with a temporary server error, rate limit, time out
+# or dropped connection, waiting a little longer before each attempt. Once out
+# of retries, the last error is printed as usual.
+RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[408, 429, 500, 502, 503, 504], raise_on_status=False)
+
+# Share one connection pool across all API requests, so that requests reuse
+# open connections instead of making a new one for every call.
+SESSION = requests.Session()
+SESSION.params = {'api_token': API_TOKEN}
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRIES, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def api_get(endpoint, options):
+    if CACHE_FILE:
+        cache_key = json.dumps([endpoint, sorted(options.items())])
+        data = cache_read(cache_key)
+        if data is not None:
+            return data
+
+    # print("Querying API: ", endpoint, options)
+    try:
+        response = SESSION.get(url=URL+endpoint, params=options, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        # Raised once retries run out without any response to print
+        print(e)
+        sys.exit(0)
+
+    data = json_or_print_error(response)
+    if CACHE_FILE:
+        cache_write(cache_key, data)
+    return data
+
+def open_cache():
+    global _cache
+    if _cache is None:
+        _cache = shelve.open(CACHE_FILE)
+        atexit.register(_cache.close)
+    return _cache
+
+def cache_read(key):
+    with _cache_lock:
+        entry = open_cache().get(key)
+    if entry is not None and time.time() - entry[0] < CACHE_EXPIRATION:
+        return entry[1]
+
+def cache_write(key, data):
+    with _cache_lock:
+        open_cache()[key] = (time.time(), data)
+
 def json_or_print_error(response):
     if response.status_code == requests.codes.ok:
+        if orjson:
+            return orjson.loads(response.content)
         return response.json()
     else:
         print(response.status_code)
@@ -33,28 +117,41 @@ def json_or_print_error(response):
         sys.exit(0)
 
 def encode(str):
-    if sys.version_info[0] < 3:
-        return urllib.quote_plus(str)
-    else:
-        return urllib.parse.quote_plus(str)
+    return urllib.parse.quote_plus(str)
+
+def pool_map(func, items):
+    # Calls func for each item using a pool of threads, yielding results in
+    # the same order as items. API errors call sys.exit(), which would only
+    # end the worker thread, so hand those back to exit from the main thread.
+    def call(item):
+        try:
+            return False, func(item)
+        except SystemExit as e:
+            return True, e
+
+    pool = ThreadPool(MAX_WORKERS)
+    try:
+        for exited, result in pool.imap(call, items):
+            if exited:
+                raise result
+            yield result
+    finally:
+        pool.terminate()
 
 def main():
 
-    variant = raw_input("Type genomic variant (e.g. NC_000012.11:g.57489193T>C): ")
+    variant = input("Type genomic variant (e.g. NC_000012.11:g.57489193T>C): ")
 
-    response = requests.get(url=URL+"suggestions", params={'api_token': API_TOKEN, 'variant': variant})
-
-    data = json_or_print_error(response)
+    data = api_get("suggestions", {'variant': variant})
     encoded_match = encode(data[0]['matched'])
 
     print("Matched: " + data[0]['matched'])
     print("Mastermind link: https://mastermind.genomenon.com/detail?disease=all%20diseases&mutation=" + encoded_match)
     print("Maps to " + str(len(data)) + " effects:")
 
-    for match in data:
-        canonical = match['canonical']
-        count_response = requests.get(url=URL+"counts", params={'api_token': API_TOKEN, 'variant': canonical})
-        count_data = json_or_print_error(count_response)
+    # Look up every effect's counts at once, printing them in the same order
+    canonicals = [match['canonical'] for match in data]
+    for canonical, count_data in zip(canonicals, pool_map(lambda canonical: api_get("counts", {'variant': canonical}), canonicals)):
         print("\t" + canonical + " - " + str(count_data['article_count']) + " articles, direct link: " + count_data['url'])
 
 if __name__ == "__main__":
@@ -88,23 +88,47 @@ for large OMIT_ONE_PMID_MATCHES_FROM_ASSOCIATIONS_FILE input variant data sets
 by truncated all listed associations present in only a single PMID with each of
 the input variants. Set this to True for larger data sets to increase
 specificity (and decrease sensitivity) of the associaitons file.
+
+If you expect to run this several times over overlapping variants, you may also
+set CACHE_FILE below, so that API responses are saved to disk and reused on
+later runs instead of being fetched again.
 """
 
 import sys
 import re
+import csv
 import json
+import shelve
+import atexit
+import threading
 import requests
-import urllib
-from collections import defaultdict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import urllib.parse
+import itertools
+from collections import defaultdict, deque
+from multiprocessing.pool import ThreadPool
 import datetime
 import time
-import codecs
+
+# orjson is optional, but parses API responses faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 URL = "https://mastermind.genomenon.com/api/v2/"
 
 # Find your API token by logging in, visiting https://mastermind.genomenon.com/api, and clicking the link that says "Click here to fetch your API token".
 API_TOKEN = "INSERT API TOKEN HERE"
 
+# To reuse API responses across runs, set this to the path of a file to cache
+# them in, e.g. "mastermind_cache". Delete the file to clear the cache:
+CACHE_FILE = False #"mastermind_cache"
+
+# Number of seconds after which a cached API response is fetched again:
+CACHE_EXPIRATION = 24*60*60
+
 # Don't include articles that lack PHENOTYPES:
 FILTER_ON_PHENOTYPES = False
 
@@ -132,17 +156,88 @@ ONLY_NUCLEOTIDE_CITATIONS = False
 # matching).
 ONLY_NUCLEOTIDE_CITATIONS_FOR_NON_CODING = True
 
-def api_get(endpoint, options, tries=0):
-    params = options.copy()
-    params.update({'api_token': API_TOKEN})
+# Number of pages of articles to request ahead of the page being processed.
+# When only nucleotide-specific citations are kept, up to this many extra pages
+# may be requested after the last page with matching citations.
+PREFETCH_PAGES = 8
 
-    # print("Querying API: ", endpoint, options)
-    response = requests.get(url=URL+endpoint, params=params)
+# Maximum number of article_info requests to have in flight at once:
+MAX_WORKERS = 16
+
+# Number of seconds to wait for the API to respond before retrying a request:
+TIMEOUT = 30
+
+# Retry requests that fail with a temporary server error or rate limit, waiting
+# a little longer before each attempt. Once out of retries, requests that timed
+# out or got an internal server error are skipped.
+RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[408, 429, 500, 502, 503, 504], raise_on_status=False)
+
+# Share one connection pool across all API requests, so that requests reuse
+# open connections instead of making a new one for every call.
+SESSION = requests.Session()
+SESSION.params = {'api_token': API_TOKEN}
+SESSION.mount("https://", HTTPAdapter(max_retries=RETRIES, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS))
+
+# Size of the write buffer for each output file:
+OUTPUT_BUFFER_SIZE = 1024*1024
+
+# Variant names that refer to a specific nucleotide change, and variant
+# categories for deep intronic or UTR variants:
+VARIANT_DNA_RE = re.compile(r'c\.\d+|g\.\d+|rs\d+|IVS\d')
+NON_CODING_RE = re.compile(r'(int|UTR)$')
+
+_cache = None
+_cache_lock = threading.Lock()
+_responses = {}
+_last_progress = 0
 
-    return json_or_print_error(response, endpoint, options, tries)
+def api_get(endpoint, options):
+    if CACHE_FILE:
+        cache_key = json.dumps([endpoint, sorted(options.items())])
+        data = cache_read(cache_key)
+        if data is not None:
+            return data
 
-def json_or_print_error(response, endpoint, options, tries):
+    # print("Querying API: ", endpoint, options)
+    try:
+        response = SESSION.get(url=URL+endpoint, params=options, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        # Raised once retries run out without any response, e.g. after the
+        # request kept timing out or the connection kept dropping
+        sys.stdout.write('\n')
+        print("ERROR ENCOUNTERED: " + str(e))
+        print("\tRESULTING FROM REQUEST: " + endpoint)
+        print("\tWITH PARAMS: " + str(options))
+        print("SKIPPING DATA FOR ABOVE REQUEST")
+        return
+
+    data = json_or_print_error(response, endpoint, options)
+    # Skipped requests return None, and are tried again on the next run
+    if CACHE_FILE and data is not None:
+        cache_write(cache_key, data)
+    return data
+
+def open_cache():
+    global _cache
+    if _cache is None:
+        _cache = shelve.open(CACHE_FILE)
+        atexit.register(_cache.close)
+    return _cache
+
+def cache_read(key):
+    with _cache_lock:
+        entry = open_cache().get(key)
+    if entry is not None and time.time() - entry[0] < CACHE_EXPIRATION:
+        return entry[1]
+
+def cache_write(key, data):
+    with _cache_lock:
+        open_cache()[key] = (time.time(), data)
+
+def json_or_print_error(response, endpoint, options):
     if response.status_code == requests.codes.ok:
+        if orjson:
+            return orjson.loads(response.content)
         return response.json()
     else:
         sys.stdout.write('\n')
@@ -151,42 +246,80 @@ def json_or_print_error(response, endpoint, options, tries):
             print("\t" + response.text)
         print("\tRESULTING FROM REQUEST: " + endpoint)
         print("\tWITH PARAMS: " + str(options))
-        if response.status_code in [404]:
+        if response.status_code in [404, 408, 500]:
             print("SKIPPING DATA FOR ABOVE REQUEST")
             return
-        elif response.status_code in [408, 500]:
-            if tries < 1:
-                print("Time out error, trying again.")
-                return api_get(endpoint, options, tries+1)
-            else:
-                print("SKIPPING DATA FOR ABOVE REQUEST")
-                return
         sys.exit(0)
 
+def memoized_api_get(endpoint, options):
+    # Input lists often repeat variants, genes and phenotypes, so only look up
+    # each one's suggestions once per run
+    key = json.dumps([endpoint, sorted(options.items())])
+    if key not in _responses:
+        data = api_get(endpoint, options)
+        if data is None:
+            return data
+        _responses[key] = data
+    return _responses[key]
+
 def encode(str):
-    if sys.version_info[0] < 3:
-        return urllib.quote_plus(str)
-    else:
-        return urllib.parse.quote_plus(str)
+    return urllib.parse.quote_plus(str)
+
+def prefetch_map(func, items, size=PREFETCH_PAGES):
+    # Calls func for each item in order, using a pool of threads to keep up to
+    # size calls running ahead of the result being consumed. API errors call
+    # sys.exit(), which would only end the worker thread, so hand those back
+    # to exit from the main thread.
+    def call(item):
+        try:
+            return False, func(item)
+        except SystemExit as e:
+            return True, e
+
+    items = iter(items)
+    pool = ThreadPool(size)
+    try:
+        pending = deque(pool.apply_async(call, (item,)) for item in itertools.islice(items, size))
+        while pending:
+            exited, result = pending.popleft().get()
+            if exited:
+                raise result
+            for item in itertools.islice(items, 1):
+                pending.append(pool.apply_async(call, (item,)))
+            yield result
+    finally:
+        pool.terminate()
 
 def print_progress(iteration, total, prefix='', suffix='', decimals=1, bar_length=100):
+    global _last_progress
+    # A progress bar is only useful on a terminal, not when output is
+    # redirected to a file
+    if not sys.stdout.isatty():
+        return
+
+    # Redraw at most 20 times a second, but always draw the finished bar
+    now = time.time()
+    if iteration != total and now - _last_progress < 0.05:
+        return
+    _last_progress = now
+
     str_format = "{0:." + str(decimals) + "f}"
     fraction = 1 if total == 0 else iteration / float(total)
     percents = str_format.format(100 * fraction)
     filled_length = int(round(bar_length * fraction))
     bar = 'M' * filled_length + '-' * (bar_length - filled_length)
 
-    sys.stdout.write('\r%s |%s| %s%s %s' % (prefix, bar, percents, '%', suffix)),
+    sys.stdout.write('\r%s |%s| %s%s %s' % (prefix, bar, percents, '%', suffix))
 
     if iteration == total:
         sys.stdout.write('\n')
     sys.stdout.flush()
 
 def variant_dna_format(variant):
-    return re.search(r'c\.\d+', variant) or re.search(r'g\.\d+', variant) or re.search(r'rs\d+', variant) or re.search(r'IVS\d', variant)
+    return VARIANT_DNA_RE.search(variant)
 
 def coding_or_splice(variant):
-    return not re.search(r'(int|UTR)$', variant)
+    return not NON_CODING_RE.search(variant)
 
 def specificity_match(variant_dna_specificity, variant_coding_or_splice, article):
     if not variant_dna_specificity:
@@ -206,26 +339,31 @@ def get_articles(options, variant_bucket):
     variant_dna_specificity = 'variant' in options and variant_dna_format(options['variant'])
     variant_coding_or_splice = 'variant' in options and coding_or_splice(variant_bucket)
 
-    if data and "articles" in data:
+    # Without any articles on the first page there's nothing to page through,
+    # and no last article to check for a nucleotide-specific citation
+    if data and data.get("articles"):
         pmids = [article['pmid'] for article in data['articles'] if specificity_match(variant_dna_specificity, variant_coding_or_splice, article)]
 
         articles = int(data['article_count'])
         pages = int(data['pages'])
 
-        print_progress(1, pages, prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['variant']) + ':', suffix = 'Complete', bar_length = 50)
+        progress_prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['variant']) + ':'
+        print_progress(1, pages, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
         if pages > 1:
             if specificity_match(variant_dna_specificity, variant_coding_or_splice, data['articles'][-1]):
-                for page in range(2, pages+1):
-                    print_progress(page, pages, prefix = 'Getting ' + str(articles) + ' articles for ' + str(options['variant']) + ':', suffix = 'Complete', bar_length = 50)
+                # Request the following pages ahead of time, so they download
+                # while the current page is being processed
+                page_data = prefetch_map(lambda page: api_get("articles", dict(options, page=page)), range(2, pages+1))
+                for page, data in enumerate(page_data, 2):
+                    print_progress(page, pages, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
-                    options.update({'page': page})
-                    data = api_get("articles", options)
-                    pmids = pmids + [article['pmid'] for article in data['articles'] if specificity_match(variant_dna_specificity, variant_coding_or_splice, article)]
+                    pmids.extend(article['pmid'] for article in data['articles'] if specificity_match(variant_dna_specificity, variant_coding_or_splice, article))
                     if not specificity_match(variant_dna_specificity, variant_coding_or_splice, data['articles'][-1]):
                         sys.stdout.write('\n')
                         sys.stdout.flush()
                         break;
+                page_data.close()
             else:
                 sys.stdout.write('\n')
                 sys.stdout.flush()
@@ -235,110 +373,141 @@ def get_articles(options, variant_bucket):
 
     return articles, pmids
 
-def has_phenotypes(phenotypes, article_hpo_terms):
-    article_hpo_ids = [article_hpo_term['key'] for article_hpo_term in article_hpo_terms]
-    intersection = [hpo_id for hpo_id in phenotypes.values() if hpo_id in article_hpo_ids]
-    return len(intersection) > 0
+def has_phenotypes(phenotype_ids, article_hpo_terms):
+    return any(article_hpo_term['key'] in phenotype_ids for article_hpo_term in article_hpo_terms)
 
-def variant_key(pmid_gene, pmid_variant):
-    return pmid_gene['symbol'] + ':' + pmid_variant['key']
+def associations():
+    # Every phenotype and group of co-mentioned terms tracks the same fields, so
+    # create them all up front rather than through a nested defaultdict
+    return {'pmids': set(), 'genes': set(), 'variants': set(), 'diseases': set(), 'phenotypes': set()}
+
+def fetch_article_info(variant_info):
+    # Many variants share articles, so fetch each PMID's article_info once, and
+    # run the requests concurrently rather than one after another
+    pmids = list(dict.fromkeys(pmid for values in variant_info.values() for pmid in values['pmids']))
 
-def aggregate_article_info(variant_info, phenotypes):
     article_info = {}
+    total = len(pmids)
+    progress_prefix = 'Getting PMID info for ' + str(total) + ' articles:'
+    for current, (pmid, data) in enumerate(zip(pmids, prefetch_map(lambda pmid: api_get("article_info", {'pmid': pmid}), pmids, MAX_WORKERS)), 1):
+        print_progress(current, total, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
+        article_info[pmid] = data
+
+    return article_info
+
+def aggregate_article_info(variant_info, phenotypes):
+    article_info = fetch_article_info(variant_info)
     filtered_article_info = {}
-    phenotype_info = defaultdict(lambda: defaultdict(lambda: set([])))
-    comentioned_variants = defaultdict(lambda: defaultdict(lambda: set([])))
-    comentioned_phenotypes = defaultdict(lambda: defaultdict(lambda: set([])))
+    article_records = {}
+    phenotype_info = defaultdict(associations)
+    comentioned_variants = defaultdict(associations)
+    comentioned_phenotypes = defaultdict(associations)
+
+    # Input variants are matched to the variants cited in each article ignoring
+    # case, so index them by their uppercased names up front
+    input_variants_by_upper = defaultdict(list)
+    for input_variant in variant_info:
+        input_variants_by_upper[input_variant.upper()].append(input_variant)
+    phenotype_ids = set(phenotypes.values())
+
+    # An article's genes, variants, diseases and phenotypes are the same for
+    # every input variant that cites it, so gather them once per article
+    for pmid, data in article_info.items():
+        if data == None:
+            print("COULDN'T GET INFO FOR ARTICLE. SKIPPING ANALYSIS FOR PMID " + pmid)
+            continue
+
+        if FILTER_ON_PHENOTYPES and ('hpo_terms' not in data or not has_phenotypes(phenotype_ids, data['hpo_terms'])):
+            # print("Aritcle PMID " + pmid + " does not contain phenotypes. Skipping.")
+            continue
+        else:
+            filtered_article_info[pmid] = data
+
+        pmid_diseases = []
+        pmid_genes = []
+        pmid_variants = []
+        pmid_phenotypes = []
+        pmid_matching_phenotypes = []
+
+        if 'diseases' in data:
+            for disease in data['diseases']:
+                pmid_diseases.append(disease['key'])
+
+        for pmid_gene in data['genes']:
+            gene_symbol = pmid_gene['symbol']
+            pmid_genes.append(gene_symbol)
+
+            for pmid_variant in pmid_gene.get('variants', []):
+                pmid_variants.append(gene_symbol + ':' + pmid_variant['key'])
+
+        if 'hpo_terms' in data:
+            for phenotype in data['hpo_terms']:
+                pmid_phenotypes.append(phenotype['term'])
+
+                if phenotype['term'] in phenotypes:
+                    pmid_matching_phenotypes.append(phenotype['term'])
+                    phenotype_info[phenotype['term']]['pmids'].add(pmid)
+                    if 'diseases' in data:
+                        phenotype_info[phenotype['term']]['diseases'].update(pmid_diseases)
+                    # All PMIDS will have at least one gene and variant, since we returned all PMIDs by input variants
+                    phenotype_info[phenotype['term']]['genes'].update(pmid_genes)
+                    phenotype_info[phenotype['term']]['variants'].update(pmid_variants)
+
+        pmid_variants_upper = set(pmid_variant.upper() for pmid_variant in pmid_variants)
+        pmid_comentioned_variants = sorted(input_variant for pmid_variant in pmid_variants_upper for input_variant in input_variants_by_upper.get(pmid_variant, []))
+        pmid_comentioned_phenotypes = sorted(set(pmid_matching_phenotypes))
+
+        if len(pmid_comentioned_variants) > 1:
+            comentioned_key = "; ".join(pmid_comentioned_variants)
+            comentioned_variants[comentioned_key]['pmids'].add(pmid)
+            comentioned_variants[comentioned_key]['phenotypes'].update(pmid_comentioned_phenotypes)
+            comentioned_variants[comentioned_key]['diseases'].update(pmid_diseases)
+
+        if len(pmid_comentioned_phenotypes) > 1:
+            comentioned_key = "; ".join(pmid_comentioned_phenotypes)
+            comentioned_phenotypes[comentioned_key]['pmids'].add(pmid)
+            comentioned_phenotypes[comentioned_key]['variants'].update(pmid_comentioned_variants)
+            comentioned_phenotypes[comentioned_key]['diseases'].update(pmid_diseases)
+
+        article_records[pmid] = {'diseases': pmid_diseases, 'genes': pmid_genes, 'variants': pmid_variants, 'phenotypes': pmid_phenotypes, 'matching_phenotypes': pmid_matching_phenotypes}
 
     for variant, values in variant_info.items():
-        pmids_by_disease = defaultdict(lambda: [])
-        pmids_by_phenotype = defaultdict(lambda: [])
-        pmids_by_variant = defaultdict(lambda: [])
-        pmids_by_gene = defaultdict(lambda: [])
-        matching_phenotypes = set([])
+        # An article can list the same gene, variant, disease or phenotype
+        # more than once, so only count each PMID once for each of them
+        pmids_by_disease = defaultdict(set)
+        pmids_by_phenotype = defaultdict(set)
+        pmids_by_variant = defaultdict(set)
+        pmids_by_gene = defaultdict(set)
+        matching_phenotypes = set()
         pmids_matching_phenotypes = []
-        diseases_matching_phenotypes = set([])
+        diseases_matching_phenotypes = set()
 
         current = 0
         total = len(values['pmids'])
+        progress_prefix = 'Inspecting PMID info for ' + str(variant) + ':'
 
         for pmid in values['pmids']:
             current += 1
-            pmid_matches_phenotypes = False
-            print_progress(current, total, prefix = 'Inspecting PMID info for ' + str(variant) + ':', suffix = 'Complete', bar_length = 50)
-
-            if pmid in article_info:
-                data = article_info[pmid]
-            else:
-                # Get article_info for each PMID
-                data = api_get("article_info", {'pmid': pmid})
-                article_info[pmid] = data
+            print_progress(current, total, prefix = progress_prefix, suffix = 'Complete', bar_length = 50)
 
-            if data == None:
-                print("COULDN'T GET INFO FOR ARTICLE. SKIPPING ANALYSIS FOR PMID " + pmid)
+            # Articles without info, or filtered out, have no record
+            record = article_records.get(pmid)
+            if record is None:
                 continue
 
-            if FILTER_ON_PHENOTYPES and ('hpo_terms' not in data or not has_phenotypes(phenotypes, data['hpo_terms'])):
-                # print("Aritcle PMID " + pmid + " does not contain phenotypes. Skipping.")
-                continue
-            else:
-                filtered_article_info[pmid] = data
-
-            pmid_diseases = []
-            pmid_genes = []
-            pmid_variants = []
-            pmid_phenotypes = []
-
-            if 'diseases' in data:
-                for disease in data['diseases']:
-                    pmids_by_disease[disease['key']].append(pmid)
-                    pmid_diseases.append(disease['key'])
-
-            for pmid_gene in data['genes']:
-                pmids_by_gene[pmid_gene['symbol']].append(pmid)
-                pmid_genes.append(pmid_gene['symbol'])
-
-                if 'variants' in pmid_gene:
-                    for pmid_variant in pmid_gene['variants']:
-                        pmids_by_variant[variant_key(pmid_gene, pmid_variant)].append(pmid)
-                        pmid_variants.append(variant_key(pmid_gene, pmid_variant))
-
-            if 'hpo_terms' in data:
-                for phenotype in data['hpo_terms']:
-                    pmids_by_phenotype[phenotype['term']].append(pmid)
-                    pmid_phenotypes.append(phenotype['term'])
-
-                    if phenotype['term'] in phenotypes.keys():
-                        matching_phenotypes.add(phenotype['term'])
-                        pmid_matches_phenotypes = True
-                        phenotype_info[phenotype['term']]['pmids'].add(pmid)
-                        if 'diseases' in data:
-                            phenotype_info[phenotype['term']]['diseases'].update(pmid_diseases)
-                        # All PMIDS will have at least one gene and variant, since we returned all PMIDs by input variants
-                        phenotype_info[phenotype['term']]['genes'].update(pmid_genes)
-                        phenotype_info[phenotype['term']]['variants'].update(pmid_variants)
-
-            pmid_comentioned_variants = [input_variant for input_variant in variant_info.keys() if input_variant.upper() in [pmid_variant.upper() for pmid_variant in pmid_variants]]
-            pmid_comentioned_variants.sort()
-            pmid_comentioned_phenotypes = [input_phenotype_term for input_phenotype_term in phenotypes.keys() if input_phenotype_term in pmid_phenotypes]
-            pmid_comentioned_phenotypes.sort()
-
-            if len(pmid_comentioned_variants) > 1:
-                comentioned_key = "; ".join(pmid_comentioned_variants)
-                comentioned_variants[comentioned_key]['pmids'].add(pmid)
-                comentioned_variants[comentioned_key]['phenotypes'].update(pmid_comentioned_phenotypes)
-                comentioned_variants[comentioned_key]['diseases'].update(pmid_diseases)
-
-            if len(pmid_comentioned_phenotypes) > 1:
-                comentioned_key = "; ".join(pmid_comentioned_phenotypes)
-                comentioned_phenotypes[comentioned_key]['pmids'].add(pmid)
-                comentioned_phenotypes[comentioned_key]['variants'].update(pmid_comentioned_variants)
-                comentioned_phenotypes[comentioned_key]['diseases'].update(pmid_diseases)
-
-            if pmid_matches_phenotypes:
-                matching_phenotypes.update(pmid_comentioned_phenotypes)
+            for disease in record['diseases']:
+                pmids_by_disease[disease].add(pmid)
+            for gene in record['genes']:
+                pmids_by_gene[gene].add(pmid)
+            for pmid_variant in record['variants']:
+                pmids_by_variant[pmid_variant].add(pmid)
+            for phenotype in record['phenotypes']:
+                pmids_by_phenotype[phenotype].add(pmid)
+
+            if record['matching_phenotypes']:
+                matching_phenotypes.update(record['matching_phenotypes'])
                 pmids_matching_phenotypes.append(pmid)
-                diseases_matching_phenotypes.update(pmid_diseases)
+                diseases_matching_phenotypes.update(record['diseases'])
 
         # Else leave pmids the same
         if FILTER_ON_PHENOTYPES:
@@ -353,9 +522,6 @@ def aggregate_article_info(variant_info, phenotypes):
 
     return variant_info, filtered_article_info, phenotype_info, comentioned_variants, comentioned_phenotypes
 
-def pipe_delimited_field(values):
-    return "\"" + re.sub(r"\"", "\"\"", "|".join(values)) + "\""
-
 def main(args):
     print("Welcome to the Variant Phenotype Evidence program powered by Mastermind.")
 
@@ -379,13 +545,16 @@ def main(args):
     phenotype_inputs = []
 
     with open(phenotypes_filename, "r") as lines:
-        phenotype_inputs = lines.read().splitlines()
+        # Skip blank lines rather than looking up an empty phenotype, and only
+        # look up each phenotype once
+        phenotype_inputs = list(dict.fromkeys(line.strip() for line in lines if line.strip()))
 
     phenotypes_parsed = 1
     total_phenotypes = len(phenotype_inputs)
-    for phenotype in phenotype_inputs:
+    # Look up the phenotypes concurrently, handling the results in input order
+    phenotype_suggestions = prefetch_map(lambda phenotype: memoized_api_get("suggestions", {'hpo': phenotype}), phenotype_inputs, MAX_WORKERS)
+    for phenotype, phenotype_data in zip(phenotype_inputs, phenotype_suggestions):
         print_progress(phenotypes_parsed, total_phenotypes, prefix = 'Parsing phenotypes:', suffix = 'Complete', bar_length = 50)
-        phenotype_data = api_get("suggestions", {'hpo': phenotype})
         if len(phenotype_data) > 0:
             phenotypes[phenotype_data[0]['name']] = phenotype_data[0]['canonical']
         else:
@@ -393,32 +562,35 @@ def main(args):
         phenotypes_parsed += 1
 
     with open(variants_filename, "r") as lines:
-        # Loop through lines in variant input file
-        for line in lines:
+        # Skip blank lines rather than looking up an empty variant, and only
+        # look up each variant once
+        variant_inputs = list(dict.fromkeys(line.strip() for line in lines if line.strip()))
+
+        # Loop through variants from the input file
+        for variant_input in variant_inputs:
             if STOP_AFTER and variants_with_articles > STOP_AFTER:
                 break
-            variant_input = line.strip()
             variant_bucket = None
             if SKIP_VARIANT_SUGGESTION_NORMALIZATION:
                 canonical_variant = variant_input
 
                 if ONLY_NUCLEOTIDE_CITATIONS_FOR_NON_CODING:
-                    variant_data = api_get("suggestions", {'variant': variant_input})
+                    variant_data = memoized_api_get("suggestions", {'variant': variant_input})
                     if len(variant_data) > 0:
                         variant_bucket = variant_data[0]['canonical']
                     else:
                         print("Could not get variant data for", variant_input)
             else:
-                variant_data = api_get("suggestions", {'variant': variant_input})
+                variant_data = memoized_api_get("suggestions", {'variant': variant_input})
                 if len(variant_data) > 0:
                     canonical_variant = variant_data[0]['canonical']
                 else:
                     # Try again with gene suggestion
                     gene_input = variant_input.split(":", 1)
-                    gene_data = api_get("suggestions", {'gene': gene_input[0]})
+                    gene_data = memoized_api_get("suggestions", {'gene': gene_input[0]})
                     if len(gene_data) > 0:
                         canonical_gene = gene_data[0]['canonical']
-                        variant_data = api_get("suggestions", {'variant': canonical_gene + ':' + gene_input[1]})
+                        variant_data = memoized_api_get("suggestions", {'variant': canonical_gene + ':' + gene_input[1]})
                         if len(variant_data) > 0:
                             canonical_variant = variant_data[0]['canonical']
                         else:
@@ -451,8 +623,9 @@ def main(args):
     # Save relevant article data for each unique article across the input gene set to articles.csv file
     articles_file_path = variants_filename + ".articles.csv"
     print("Article info in " + articles_file_path)
-    with codecs.open(articles_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["PMID", "Journal", "Title", "Publication Date", "Genes", "Variants", "Diseases", "Phenotypes"]) + "\n")
+    with open(articles_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["PMID", "Journal", "Title", "Publication Date", "Genes", "Variants", "Diseases", "Phenotypes"])
         for pmid, article in article_info.items():
             pmid_diseases = []
             pmid_phenotypes = []
@@ -467,42 +640,40 @@ def main(args):
                 if "variants" in gene:
                     pmid_variants.extend([gene["symbol"] + ":" + variant["key"] for variant in gene["variants"]])
 
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[pmid], [article["journal"]], [article["title"]], [article["publication_date"]], pmid_genes, pmid_variants, pmid_diseases, pmid_phenotypes]]) + "\n")
+            writer.writerow([pmid, article["journal"], article["title"], article["publication_date"], "|".join(pmid_genes), "|".join(pmid_variants), "|".join(pmid_diseases), "|".join(pmid_phenotypes)])
 
     print('-'*100)
 
     # Save relevant article data, organized by unique phenotypes to phenotypes.csv
     phenotypes_file_path = variants_filename + ".phenotypes.csv"
     print("Phenotype info in " + phenotypes_file_path)
-    with codecs.open(phenotypes_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["Phenotype", "PMIDs", "Genes", "Variants", "Diseases", "Other Phenotypes"]) + "\n")
+    with open(phenotypes_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["Phenotype", "PMIDs", "Genes", "Variants", "Diseases", "Other Phenotypes"])
         for phenotype, info in phenotype_info.items():
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[phenotype], info["pmids"], info["genes"], info["variants"], info["diseases"], info["phenotypes"]]]) + "\n")
+            writer.writerow([phenotype, "|".join(info["pmids"]), "|".join(info["genes"]), "|".join(info["variants"]), "|".join(info["diseases"]), "|".join(info["phenotypes"])])
 
     print('-'*100)
 
     # Save relevant article data, organized by unique variants from input variant set to variants.csv
     variants_file_path = variants_filename + ".variants.csv"
     print("Variant info in " + variants_file_path)
-    with codecs.open(variants_file_path, 'wb', 'utf-8') as output_file:
-        output_file.write(",".join(["Variant", "PMIDs", "Genes", "Other Variants", "Diseases", "Phenotypes"]) + "\n")
+    with open(variants_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
+        writer = csv.writer(output_file, lineterminator='\n')
+        writer.writerow(["Variant", "PMIDs", "Genes", "Other Variants", "Diseases", "Phenotypes"])
         for variant, info in variant_info.items():
-            variant_diseases = [variant_disease for variant_disease in info["diseases"].keys()]
-            variant_phenotypes = [variant_phenotype for variant_phenotype in info["phenotypes"].keys()]
-            variant_genes = [variant_gene for variant_gene in info["genes"].keys()]
-            variant_variants = [variant_variant for variant_variant in info["variants"].keys()]
-            output_file.write(",".join([pipe_delimited_field(field) for field in [[variant], info["pmids"], variant_genes, variant_variants, variant_diseases, variant_phenotypes]]) + "\n")
+            writer.writerow([variant, "|".join(info["pmids"]), "|".join(info["genes"]), "|".join(info["variants"]), "|".join(info["diseases"]), "|".join(info["phenotypes"])])
 
     print('-'*100)
 
     # Save structured associations lists for input gene set to associations-summary.txt
     associations_summary_file_path = variants_filename + ".associations-summary.txt"
     print("Association summary info in " + associations_summary_file_path)
-    with codecs.open(associations_summary_file_path, 'wb', 'utf-8') as output_file:
+    with open(associations_summary_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
 
         if len(comentioned_variants) > 0:
             output_file.write("Found co-cited variants in the literature:\n")
-            for variants, data in sorted(comentioned_variants.items(), key=lambda item: 1 if len(item[1]['phenotypes']) == 0 else 1/len(item[1]['phenotypes'])):
+            for variants, data in sorted(comentioned_variants.items(), key=lambda item: (len(item[1]['phenotypes']), len(item[1]['pmids'])), reverse=True):
                 output_file.write("\t" + variants + ":\n")
                 output_file.write("\t\tPMIDS\n:")
                 output_file.write("\t\t\t" + ", ".join(data["pmids"]) + "\n")
@@ -515,7 +686,7 @@ def main(args):
 
         if len(comentioned_phenotypes) > 0:
             output_file.write("Found co-cited phenotypes in the literature:\n")
-            for phenotypes, data in sorted(comentioned_phenotypes.items(), key=lambda item: 1/(len(item[1]['variants']) if len(item[1]['variants']) > 0 else 1)):
+            for phenotypes, data in sorted(comentioned_phenotypes.items(), key=lambda item: (len(item[1]['variants']), len(item[1]['pmids'])), reverse=True):
                 output_file.write("\t" + phenotypes + ":\n")
                 output_file.write("\t\tPMIDS:\n")
                 output_file.write("\t\t\t" + ", ".join(data["pmids"]) + "\n")
@@ -529,7 +700,7 @@ def main(args):
     # Save structured associations lists for input gene set to associations.txt
     associations_file_path = variants_filename + ".associations.txt"
     print("Association info in " + associations_file_path)
-    with codecs.open(associations_file_path, 'wb', 'utf-8') as output_file:
+    with open(associations_file_path, 'w', encoding='utf-8', newline='', buffering=OUTPUT_BUFFER_SIZE) as output_file:
 
         for variant, data in variant_info.items():
             if len(data['pmids']) == 0:
@@ -557,7 +728,7 @@ def main(args):
                         if OMIT_ONE_PMID_MATCHES_FROM_ASSOCIATIONS_FILE and len(values[1]) <= 1:
                             output_file.write("\t\t(Truncated associations with only one PMID)\n")
                             break
-                        output_file.write("\t\t" + str(values[0]) + ": " + ', '.join(values[1]) + "\n")
+                        output_file.write("\t\t" + str(values[0]) + ": " + ', '.join(sorted(values[1])) + "\n")
 
                 output_file.write("\tVariants with supporting PMIDs:\n")
                 if len(data['variants']) == 0:
@@ -567,7 +738,7 @@ def main(args):
                         if OMIT_ONE_PMID_MATCHES_FROM_ASSOCIATIONS_FILE and len(values[1]) <= 1:
                             output_file.write("\t\t(Truncated associations with only one PMID)\n")
                             break
-                        output_file.write("\t\t" + str(values[0]) + ": " + ', '.join(values[1]) + "\n")
+                        output_file.write("\t\t" + str(values[0]) + ": " + ', '.join(sorted(values[1])) + "\n")
 
                 output_file.write("\tDiseases with supporting PMIDs:\n")
                 if len(data['diseases']) == 0:
@@ -577,7 +748,7 @@ def main(args):
                         if OMIT_ONE_PMID_MATCHES_FROM_ASSOCIATIONS_FILE and len(values[1]) <= 1:
                             output_file.write("\t\t(Truncated associations with only one PMID)\n")
                             break
-                        output_file.write("\t\t" + str(values[0]).title() + ": " + ', '.join(values[1]) + "\n")
+                        output_file.write("\t\t" + str(values[0]).title() + ": " + ', '.join(sorted(values[1])) + "\n")
 
                 output_file.write("\tPhenotypes with supporting PMIDs:\n")
                 if len(data['phenotypes']) == 0:
@@ -587,7 +758,7 @@ def main(args):
                         if OMIT_ONE_PMID_MATCHES_FROM_ASSOCIATIONS_FILE and len(values[1]) <= 1:
                             output_file.write("\t\t(Truncated associations with only one PMID)\n")
                             break
-                        output_file.write("\t\t" + str(values[0]).title() + ": " + ', '.join(values[1]) + "\n")
+                        output_file.write("\t\t" + str(values[0]).title() + ": " + ', '.join(sorted(values[1])) + "\n")
 
 if __name__ == "__main__":
     main(sys.argv)